@@ -0,0 +1,147 @@
+"""
+Adaptive per-host concurrency and timeout control for probing.
+
+Works like TCP congestion control, one controller per host:
+
+- Timeout: Jacobson/Karels estimator, srtt + 4 * rttvar, clamped to
+  [SCAN_MIN_TIMEOUT, SCAN_MAX_TIMEOUT], tracked per port: a slow web app
+  shouldn't inherit the timeout of a fast service next to it. A port that
+  hasn't answered yet gets SCAN_INITIAL_TIMEOUT. Each timeout doubles a backoff
+  factor (like TCP's RTO backoff) and the next success resets it, so a slow NAS
+  gets more time instead of being dropped.
+- Concurrency: AIMD window per host. Each success grows it by 1/window (about +1 per
+  round trip), each sign of congestion halves it, never below 1.
+  Fragile embedded devices are not hammered with parallel requests.
+
+Only evidence of load counts as congestion: connect or pool timeouts, and
+timeouts or broken connections on a port that has already answered with HTTP.
+Most open ports nmap reports don't speak HTTP at all (SSH banners, silent
+databases), so failing on a port that never answered just means "not a web
+service": no backoff, no smaller window, and the prober doesn't retry it.
+Refused connections are closed ports and don't count either.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+import httpx
+
+INITIAL_TIMEOUT = float(os.environ.get("SCAN_INITIAL_TIMEOUT", "3.0"))
+MIN_TIMEOUT = float(os.environ.get("SCAN_MIN_TIMEOUT", "1.0"))
+MAX_TIMEOUT = float(os.environ.get("SCAN_MAX_TIMEOUT", "15.0"))
+INITIAL_WINDOW = float(os.environ.get("SCAN_HOST_INITIAL_CONCURRENCY", "2"))
+MAX_WINDOW = float(os.environ.get("SCAN_HOST_MAX_CONCURRENCY", "8"))
+
+class _Slot:
+    """Measurement for one request; set rtt once the response headers arrive."""
+    __slots__ = ("rtt",)
+
+    def __init__(self):
+        self.rtt = None
+
+class _RttEstimator:
+    """Timeout of one (host, port)."""
+    __slots__ = ("srtt", "rttvar", "backoff", "answered")
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.backoff = 1.0
+        self.answered = False  # sent an HTTP response at least once
+
+    def timeout(self) -> float:
+        if self.srtt is None:
+            base = INITIAL_TIMEOUT
+        else:
+            base = self.srtt + 4 * self.rttvar
+        return min(MAX_TIMEOUT, max(MIN_TIMEOUT, base) * self.backoff)
+
+    def on_rtt(self, rtt: float):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+class HostController:
+    def __init__(self):
+        self.ports = {}  # port -> _RttEstimator
+        self.window = INITIAL_WINDOW
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self._cond = asyncio.Condition()
+
+    def _rtt(self, port) -> _RttEstimator:
+        estimator = self.ports.get(port)
+        if estimator is None:
+            estimator = self.ports[port] = _RttEstimator()
+        return estimator
+
+    def timeout(self, port: int = None) -> float:
+        return self._rtt(port).timeout()
+
+    def answered(self, port: int = None) -> bool:
+        """Whether `port` has sent an HTTP response, i.e. its failures say something about load."""
+        estimator = self.ports.get(port)
+        return estimator is not None and estimator.answered
+
+    def _on_success(self, port, rtt: float):
+        estimator = self._rtt(port)
+        if rtt is not None:
+            estimator.on_rtt(rtt)
+            estimator.answered = True
+        estimator.backoff = 1.0
+        self.window = min(MAX_WINDOW, self.window + 1.0 / self.window)
+
+    def _on_congestion(self, port, timed_out: bool):
+        self.errors += 1
+        self.window = max(1.0, self.window / 2)
+        if timed_out:
+            estimator = self._rtt(port)
+            estimator.backoff = min(estimator.backoff * 2, MAX_TIMEOUT / MIN_TIMEOUT)
+
+    @asynccontextmanager
+    async def slot(self, port: int = None):
+        """Wait for a free slot in this host's window, then account for the request's outcome on `port`."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.window))
+            self.in_flight += 1
+            self.requests += 1
+        slot = _Slot()
+        try:
+            yield slot
+        except httpx.ConnectError:
+            raise  # Refused / unreachable: a closed port, not congestion
+        except httpx.TransportError as e:
+            if slot.rtt is not None:
+                self._rtt(port).answered = True  # headers came, the body didn't
+            if isinstance(e, (httpx.ConnectTimeout, httpx.PoolTimeout)) or self.answered(port):
+                self._on_congestion(port, timed_out=isinstance(e, httpx.TimeoutException))
+            raise
+        else:
+            self._on_success(port, slot.rtt)
+        finally:
+            async with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def summary(self) -> str:
+        rtts = sorted(e.srtt for e in self.ports.values() if e.srtt is not None)
+        if not rtts:
+            srtt = "n/a"
+        elif len(rtts) == 1:
+            srtt = f"{rtts[0] * 1000:.0f}ms"
+        else:
+            srtt = f"{rtts[0] * 1000:.0f}-{rtts[-1] * 1000:.0f}ms"
+        timeout = max((e.timeout() for e in self.ports.values()), default=INITIAL_TIMEOUT)
+        return (f"rtt={srtt} max timeout={timeout:.1f}s "
+                f"concurrency={int(self.window)} errors={self.errors}/{self.requests}")
+
+class HostControllers(dict):
+    """host -> HostController, created on first use. One instance per scan."""
+
+    def __missing__(self, host):
+        controller = self[host] = HostController()
+        return controller
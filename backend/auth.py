@@ -12,6 +12,9 @@ import os
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey12345")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 # 1 day
+# Tickets for the change feed stream end up in URLs (and access logs), so they only live long enough to connect
+STREAM_TICKET_EXPIRE_SECONDS = 60
+STREAM_TICKET_SCOPE = "changes"
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
@@ -22,9 +25,9 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def create_access_token(data: dict):
+def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
@@ -38,7 +41,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
+        if username is None or payload.get("scope"):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
@@ -59,7 +62,7 @@ async def get_current_user_optional(token: str = Depends(oauth2_scheme_optional)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
+        if username is None or payload.get("scope"):
             return None
     except JWTError:
         return None
@@ -67,3 +70,20 @@ async def get_current_user_optional(token: str = Depends(oauth2_scheme_optional)
     result = await db.execute(select(User).where(User.username == username))
     user = result.scalars().first()
     return user
+
+# Stream tickets: EventSource can't send the Authorization header, so the
+# dashboard trades its token for a short-lived ticket that only opens the stream
+def create_stream_ticket(username: str) -> str:
+    return create_access_token({"sub": username, "scope": STREAM_TICKET_SCOPE},
+                               timedelta(seconds=STREAM_TICKET_EXPIRE_SECONDS))
+
+async def get_stream_ticket_user(ticket: str, db: AsyncSession):
+    """The user a stream ticket was issued to, or None if it is invalid or expired."""
+    try:
+        payload = jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("scope") != STREAM_TICKET_SCOPE or not payload.get("sub"):
+        return None
+    result = await db.execute(select(User).where(User.username == payload["sub"]))
+    return result.scalars().first()
@@ -0,0 +1,364 @@
+"""
+Live change feed for dashboards: /api/changes/stream (server-sent events).
+
+Every commit that touches Service, Profile or AppSettings also writes one row
+per changed record to change_events, in the same transaction. seq is the
+event id, so clients can tell when they missed something:
+
+    id: 42
+    event: change
+    data: {"seq": 42, "entity": "service", "op": "upsert", "id": 7, "profile_id": 1, "data": {...full row...}}
+
+    op is "upsert" (data is the full row), "delete" or "resync" (too much
+    changed at once, e.g. an import: re-fetch that entity).
+
+Protocol: connect, get `event: hello` with the current seq, then fetch
+/api/services etc. and apply the changes that follow. Reconnect with
+?since=<last seq> (EventSource sends Last-Event-ID by itself). If the
+events after `since` were already pruned, the server sends `event: resync`
+and the client re-fetches everything.
+
+Logged-in dashboards connect with ?ticket= (POST /api/changes/ticket, EventSource
+can't send the Authorization header). A bad or expired ticket gets a single
+`event: unauthorized`: the client should fetch a new ticket and reconnect.
+Clients that aren't logged in only get what /api/profiles and /api/services
+show a guest: the guest-default profile, its visible services (hiding a
+service arrives as a delete), and settings.
+
+Each API worker runs a single poller that reads new events once per
+CHANGE_POLL_INTERVAL (or right away after a local commit) and fans them out
+to its subscribers, so the DB load doesn't grow with the number of tablets.
+SQLite serializes writers, so seq order is commit order and polling by
+"seq > last" never skips a row.
+"""
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import delete, event, func, insert, inspect
+from sqlalchemy.future import select
+from sqlalchemy.orm import Session
+
+import database
+from database import Service, Profile, AppSettings, ChangeEvent
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = float(os.environ.get("CHANGE_POLL_INTERVAL", "1.0"))
+HEARTBEAT_INTERVAL = float(os.environ.get("CHANGE_HEARTBEAT_INTERVAL", "15"))
+# Events kept for reconnecting clients
+RETENTION = int(os.environ.get("CHANGE_FEED_RETENTION", "5000"))
+# Older events are pruned by the writer every this many events
+PRUNE_EVERY = 500
+# Bulk statements touching more rows than this become one resync event
+BULK_EVENT_LIMIT = int(os.environ.get("CHANGE_BULK_EVENT_LIMIT", "200"))
+# Pending event batches per client before it is told to resync instead
+SUBSCRIBER_QUEUE_SIZE = 100
+POLL_BATCH = 500
+
+ENTITIES = {Service: "service", Profile: "profile", AppSettings: "settings"}
+# Probe fingerprints are scanner internals, changes to them alone aren't news
+PRIVATE_COLUMNS = {"etag", "last_modified", "content_hash", "last_scanned"}
+
+def _columns(model):
+    return [c.name for c in model.__table__.columns if c.name not in PRIVATE_COLUMNS]
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _profile_id(model, row: dict):
+    if model is Service:
+        return row.get("profile_id")
+    if model is Profile:
+        return row.get("id")
+    return None
+
+def _event(model, op: str, row: Optional[dict] = None, entity_id: int = None, profile_id: int = None) -> dict:
+    """A change_events row. Deletes pass entity_id (and profile_id, if known) instead of a row."""
+    return {
+        "entity": ENTITIES[model],
+        "op": op,
+        "entity_id": row["id"] if row is not None else entity_id,
+        "profile_id": _profile_id(model, row) if row is not None else profile_id,
+        "data": json.dumps({k: _json_value(v) for k, v in row.items()}) if row is not None else None,
+        "created_at": datetime.utcnow(),
+    }
+
+# Events this worker wrote since it last pruned
+_unpruned = 0
+
+def _write(session, rows):
+    global _unpruned
+    if not rows:
+        return
+    connection = session.connection()
+    connection.execute(insert(ChangeEvent.__table__), rows)
+    session.info["changes_written"] = True
+    # Pruned here, not by the poller: events keep coming with no dashboard open
+    # (imports via curl, scans whose tab was closed, guests on the static page)
+    _unpruned += len(rows)
+    if _unpruned >= PRUNE_EVERY:
+        _unpruned = 0
+        table = ChangeEvent.__table__
+        head = select(func.max(table.c.seq)).scalar_subquery()
+        connection.execute(delete(table).where(table.c.seq <= head - RETENTION))
+
+# --- Recording ---
+# ORM flushes are recorded right away in after_flush (attribute history is still
+# there). Bulk UPDATE/DELETE statements only say which rows they hit, so their
+# ids are collected in do_orm_execute and turned into events in before_commit.
+
+def _has_public_changes(obj, columns) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[c].history.has_changes() for c in columns)
+
+@event.listens_for(Session, "after_flush")
+def _record_flush(session, flush_context):
+    rows = []
+    for obj in (*session.new, *session.dirty):
+        model = type(obj)
+        if model in ENTITIES:
+            columns = _columns(model)
+            if obj in session.new or _has_public_changes(obj, columns):
+                rows.append(_event(model, "upsert", {c: getattr(obj, c) for c in columns}))
+    for obj in session.deleted:
+        model = type(obj)
+        if model in ENTITIES:
+            ids = {"id": obj.id, "profile_id": getattr(obj, "profile_id", None)}
+            rows.append(_event(model, "delete", entity_id=obj.id, profile_id=_profile_id(model, ids)))
+    _write(session, rows)
+
+@event.listens_for(Session, "do_orm_execute")
+def _record_bulk(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    for mapper in orm_execute_state.all_mappers:
+        model = mapper.class_
+        if model not in ENTITIES:
+            continue
+        pending = orm_execute_state.session.info.setdefault("bulk_changes", {})
+        upserts, deletes, resync = pending.setdefault(model, (set(), set(), [False]))
+        if orm_execute_state.is_insert:
+            resync[0] = True  # new ids aren't known before the insert runs
+            continue
+
+        params = orm_execute_state.parameters
+        if isinstance(params, list):
+            # Bulk UPDATE by primary key: update(Service), [{"id": 1, ...}, ...]
+            ids = {p.get("id") for p in params}
+            if None in ids:
+                resync[0] = True
+                continue
+        else:
+            where = orm_execute_state.statement.whereclause
+            query = select(model.id) if where is None else select(model.id).where(where)
+            ids = set(orm_execute_state.session.execute(query).scalars())
+        (deletes if orm_execute_state.is_delete else upserts).update(ids)
+
+@event.listens_for(Session, "before_commit")
+def _record_bulk_commit(session):
+    pending = session.info.pop("bulk_changes", None)
+    if not pending:
+        return
+    rows = []
+    for model, (upserts, deletes, resync) in pending.items():
+        upserts -= deletes
+        if resync[0] or len(upserts) + len(deletes) > BULK_EVENT_LIMIT:
+            rows.append(_event(model, "resync"))
+            continue
+        if upserts:
+            table = model.__table__
+            res = session.execute(select(*[table.c[c] for c in _columns(model)]).where(table.c.id.in_(upserts)))
+            rows.extend(_event(model, "upsert", dict(r._mapping)) for r in res)
+        rows.extend(_event(model, "delete", entity_id=i) for i in deletes)
+    _write(session, rows)
+
+# Called with no arguments after every commit that wrote change events (e.g. the
+# guest page re-render), so other modules needn't track the same changes again
+commit_hooks = []
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.info.pop("changes_written", False):
+        feed.wake()
+        for hook in commit_hooks:
+            hook()
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("bulk_changes", None)
+    session.info.pop("changes_written", None)
+
+# --- Reading ---
+
+def _to_dict(row: ChangeEvent) -> dict:
+    out = {"seq": row.seq, "entity": row.entity, "op": row.op}
+    if row.entity_id is not None:
+        out["id"] = row.entity_id
+    if row.profile_id is not None:
+        out["profile_id"] = row.profile_id
+    if row.data:
+        out["data"] = json.loads(row.data)
+    return out
+
+async def _head_seq(db) -> int:
+    return (await db.execute(select(func.max(ChangeEvent.seq)))).scalar() or 0
+
+async def _guest_profile_id(db) -> Optional[int]:
+    return (await db.execute(select(Profile.id).where(Profile.is_guest_default == True))).scalars().first()
+
+async def _load_events(db, after: int, limit: int = POLL_BATCH):
+    res = await db.execute(
+        select(ChangeEvent).where(ChangeEvent.seq > after).order_by(ChangeEvent.seq).limit(limit)
+    )
+    return [_to_dict(r) for r in res.scalars()]
+
+def _sse(kind: str, payload: dict, seq: int = None) -> str:
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {kind}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+async def unauthorized():
+    """The whole stream for a client whose ticket or token didn't check out."""
+    yield _sse("unauthorized", {})
+
+# Put in a subscriber's queue when it fell too far behind
+_OVERFLOW = object()
+
+class ChangeFeed:
+    """Per-worker poller + fan-out. The poller runs only while someone listens."""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.last_seq = 0
+        self._wake = asyncio.Event()
+        self._task = None
+        self._rewind = None
+
+    def wake(self):
+        self._wake.set()
+
+    def _ensure_poller(self, head: int):
+        """Make sure the poller runs and fans out every event after `head`, what a new subscriber has read up to."""
+        if self._task is None or self._task.done():
+            self.last_seq = head
+            self._rewind = None
+            self._task = asyncio.get_running_loop().create_task(self._poll())
+        elif head < self.last_seq:
+            # Another subscriber started it from a later head. The poller moves back
+            # before its next read; subscribers skip the events they already sent.
+            self._rewind = head if self._rewind is None else min(self._rewind, head)
+            self.wake()
+
+    async def _poll(self):
+        while self.subscribers:
+            try:
+                await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._rewind is not None:
+                self.last_seq = min(self.last_seq, self._rewind)
+                self._rewind = None
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    events = await _load_events(db, self.last_seq)
+            except Exception as e:
+                logger.warning(f"Change feed poll failed: {e}")
+                continue
+            if not events:
+                continue
+            self.last_seq = events[-1]["seq"]
+            if len(events) == POLL_BATCH:
+                self.wake()  # more waiting, don't sleep
+            for queue in list(self.subscribers):
+                try:
+                    queue.put_nowait(events)
+                except asyncio.QueueFull:
+                    # Slow client: throw its backlog away and make it re-fetch
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(_OVERFLOW)
+
+    async def stream(self, since: Optional[int] = None, profile_id: Optional[int] = None, guest: bool = False):
+        """
+        SSE lines for one client. Service events of other profiles are filtered out.
+        For guests profile_id is always the guest-default profile, see the module docstring.
+        """
+        def visible(ev):
+            """The event as this client may see it, or None."""
+            if ev["entity"] == "service":
+                if (guest or profile_id is not None) and ev.get("profile_id") not in (None, profile_id):
+                    return None
+                if guest and ev["op"] == "upsert" and not ev["data"].get("is_visible", True):
+                    hidden = {k: ev[k] for k in ("seq", "entity", "id", "profile_id") if k in ev}
+                    return {**hidden, "op": "delete"}
+            elif ev["entity"] == "profile" and guest and ev.get("id") not in (None, profile_id):
+                return None
+            return ev
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        try:
+            # Registered before reading the head, and the poller goes on from no later than
+            # that head, so nothing falls between backlog and live events
+            async with database.AsyncSessionLocal() as db:
+                head = await _head_seq(db)
+                self._ensure_poller(head)
+                oldest = (await db.execute(select(func.min(ChangeEvent.seq)))).scalar()
+                if guest:
+                    profile_id = await _guest_profile_id(db)
+                backlog = []
+                if since is None:
+                    yield _sse("hello", {"seq": head}, head)
+                elif since > head or (oldest is not None and since < oldest - 1):
+                    # Pruned (or the database was replaced): deltas can't bridge the gap
+                    yield _sse("resync", {"seq": head}, head)
+                else:
+                    while True:
+                        batch = await _load_events(db, backlog[-1]["seq"] if backlog else since)
+                        backlog.extend(ev for ev in batch if ev["seq"] <= head)
+                        if len(batch) < POLL_BATCH or batch[-1]["seq"] >= head:
+                            break
+            if guest and any(ev["entity"] == "profile" for ev in backlog):
+                # The guest profile may have changed in between: start over
+                backlog = []
+                yield _sse("resync", {"seq": head}, head)
+            for ev in backlog:
+                ev = visible(ev)
+                if ev:
+                    yield _sse("change", ev, ev["seq"])
+            sent = head
+
+            while True:
+                try:
+                    events = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"  # keeps proxies from closing the connection
+                    continue
+                if events is _OVERFLOW:
+                    sent = self.last_seq
+                    yield _sse("resync", {"seq": sent}, sent)
+                    continue
+                if guest and any(ev["entity"] == "profile" and ev["seq"] > sent for ev in events):
+                    async with database.AsyncSessionLocal() as db:
+                        guest_profile = await _guest_profile_id(db)
+                    if guest_profile != profile_id:
+                        # Another profile went public: the guest sees a different dashboard now
+                        profile_id = guest_profile
+                        sent = max(sent, events[-1]["seq"])
+                        yield _sse("resync", {"seq": sent}, sent)
+                        continue
+                for ev in events:
+                    if ev["seq"] <= sent:
+                        continue
+                    sent = ev["seq"]
+                    ev = visible(ev)
+                    if ev:
+                        yield _sse("change", ev, ev["seq"])
+        finally:
+            self.subscribers.discard(queue)
+
+feed = ChangeFeed()
@@ -1,6 +1,7 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, text, inspect
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, text, inspect, event
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.future import select
 from datetime import datetime
 
@@ -14,6 +15,15 @@ DB_PATH = DATA_DIR / "services.db"
 DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
 
 engine = create_async_engine(DATABASE_URL, echo=False)
+
+# Several uvicorn workers share this file: WAL lets readers run next to the
+# writer, busy_timeout makes concurrent writers wait instead of failing.
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
 AsyncSessionLocal = sessionmaker(
     bind=engine,
     class_=AsyncSession,
@@ -78,40 +88,185 @@ class Service(Base):
     last_scanned = Column(DateTime, default=datetime.utcnow)
     sort_order = Column(Integer, default=0)
 
+    # Probe fingerprint from the last scan, used for conditional re-probing
+    etag = Column(String, nullable=True)
+    last_modified = Column(String, nullable=True)
+    content_hash = Column(String, nullable=True)  # sha256 of the page up to </head>
+    changed_fields = Column(String, nullable=True)  # comma separated, set by the last scan that changed something
+    hostname = Column(String, nullable=True)  # resolved name of the host (see resolver.py)
+
     profile = relationship("Profile", back_populates="services")
 
+# Shared scan state (see scan_state.py), so every API worker sees the same progress
+class ScanJob(Base):
+    __tablename__ = "scan_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    target = Column(String)
+    profile_id = Column(Integer, nullable=True)
+    owner = Column(String)  # "hostname:pid" of the worker running the scan
+    progress = Column(Integer, default=0)
+    is_scanning = Column(Boolean, default=True)
+    completed = Column(Boolean, default=False)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    heartbeat_at = Column(DateTime, default=datetime.utcnow)
+
+class ScanLog(Base):
+    __tablename__ = "scan_logs"
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("scan_jobs.id"), index=True)
+    message = Column(Text)
+
+# Single-row lease: whoever holds it (and keeps renewing it) owns the running scan
+class ScanLease(Base):
+    __tablename__ = "scan_lease"
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, nullable=True)
+    owner = Column(String, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+
+# Hostname cache (see resolver.py). name is NULL for hosts that didn't answer any lookup.
+class HostName(Base):
+    __tablename__ = "host_names"
+    ip = Column(String, primary_key=True)
+    name = Column(String, nullable=True)
+    source = Column(String, nullable=True)  # dns, mdns or netbios
+    resolved_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+# Probe results per scan target, shared across profiles (see scan_cache.py)
+class ScanCache(Base):
+    __tablename__ = "scan_cache"
+    key = Column(String, primary_key=True)  # target + port range + discovery method
+    results = Column(Text)  # JSON list of probe results
+    profile_id = Column(Integer, nullable=True)  # profile whose scan produced the entry
+    used_by = Column(String, nullable=True)  # comma separated ids of profiles that got these results
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+# Live change feed (see change_feed.py). seq never goes back, even after pruning.
+class ChangeEvent(Base):
+    __tablename__ = "change_events"
+    __table_args__ = {"sqlite_autoincrement": True}
+    seq = Column(Integer, primary_key=True)
+    entity = Column(String)  # service, profile or settings
+    op = Column(String)  # upsert, delete or resync
+    entity_id = Column(Integer, nullable=True)
+    profile_id = Column(Integer, nullable=True)
+    data = Column(Text, nullable=True)  # JSON row for upserts
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True)
+    name = Column(String)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+
+# --- Migrations ---
+# Ordered list of (version, name, fn). Each fn gets a sync Connection and must be
+# idempotent: an old database may already have some of the changes from the
+# column-sniffing era, and several workers may start at the same time.
+# Append new migrations at the end, never renumber.
+
+def _create_tables(connection):
+    # checkfirst: only creates tables that don't exist yet
+    Base.metadata.create_all(connection)
+
+def _add_columns(connection, table: str, columns: dict):
+    existing = [col['name'] for col in inspect(connection).get_columns(table)]
+    for col_name, col_type_default in columns.items():
+        if col_name not in existing:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {col_name} {col_type_default}"))
+            print(f"✅ Migration: Added {col_name} column to {table}")
+
+def _app_settings_display_columns(connection):
+    _add_columns(connection, 'app_settings', {
+        'default_sort_by': "VARCHAR DEFAULT 'custom'",
+        'view_mode': "VARCHAR DEFAULT 'grid'",
+        'grid_size': "VARCHAR DEFAULT 'medium'",
+        'theme_mode': "VARCHAR DEFAULT 'auto'",
+        'accent_color': "VARCHAR DEFAULT '#3b82f6'",
+    })
+
+def _service_lookup_index(connection):
+    # Scans and imports look services up by (profile_id, ip, port)
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_services_profile_ip_port ON services (profile_id, ip, port)"))
+
+def _service_fingerprint_columns(connection):
+    _add_columns(connection, 'services', {
+        'etag': "VARCHAR",
+        'last_modified': "VARCHAR",
+        'content_hash': "VARCHAR",
+        'changed_fields': "VARCHAR",
+    })
+
+def _host_names(connection):
+    HostName.__table__.create(connection, checkfirst=True)
+    _add_columns(connection, 'services', {'hostname': "VARCHAR"})
+
+def _scan_cache(connection):
+    ScanCache.__table__.create(connection, checkfirst=True)
+
+def _change_events(connection):
+    ChangeEvent.__table__.create(connection, checkfirst=True)
+
+def _scan_cache_used_by(connection):
+    _add_columns(connection, 'scan_cache', {'used_by': "VARCHAR"})
+
+MIGRATIONS = [
+    (1, "create tables", _create_tables),
+    (2, "app_settings display columns", _app_settings_display_columns),
+    (3, "service probe fingerprints", _service_fingerprint_columns),
+    (4, "services (profile_id, ip, port) index", _service_lookup_index),
+    (5, "hostname cache", _host_names),
+    (6, "shared scan result cache", _scan_cache),
+    (7, "change feed events", _change_events),
+    (8, "scan cache users", _scan_cache_used_by),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def _current_version(connection) -> int:
+    try:
+        return connection.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except Exception:
+        # No schema_version table yet (fresh or pre-migration database)
+        return 0
+
+def _run_migrations(connection):
+    current = _current_version(connection)
+    if current >= SCHEMA_VERSION:
+        return
+    SchemaVersion.__table__.create(connection, checkfirst=True)
+    for version, name, fn in MIGRATIONS:
+        if version <= current:
+            continue
+        fn(connection)
+        connection.execute(SchemaVersion.__table__.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+        print(f"✅ Migration {version}: {name}")
 
 async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        
-        # Migration: Add new columns to app_settings if they don't exist
-        def check_and_add_app_settings_columns(connection):
-            inspector = inspect(connection)
-            columns = [col['name'] for col in inspector.get_columns('app_settings')]
-
-            migrations = {
-                'default_sort_by': "VARCHAR DEFAULT 'custom'",
-                'view_mode': "VARCHAR DEFAULT 'grid'",
-                'grid_size': "VARCHAR DEFAULT 'medium'",
-                'theme_mode': "VARCHAR DEFAULT 'auto'",
-                'accent_color': "VARCHAR DEFAULT '#3b82f6'",
-            }
-
-            for col_name, col_type_default in migrations.items():
-                if col_name not in columns:
-                    try:
-                        connection.execute(text(f"ALTER TABLE app_settings ADD COLUMN {col_name} {col_type_default}"))
-                        print(f"✅ Migration: Added {col_name} column to app_settings")
-                    except Exception as e:
-                        print(f"⚠️ Migration failed for {col_name}: {e}")
-            
-        await conn.run_sync(check_and_add_app_settings_columns)
+    # Fast path for restarts: a single SELECT when the schema is up to date
+    async with engine.connect() as conn:
+        up_to_date = await conn.run_sync(_current_version) >= SCHEMA_VERSION
 
+    if not up_to_date:
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(_run_migrations)
+        except Exception:
+            # Another worker migrated concurrently and won; re-check against its result
+            async with engine.begin() as conn:
+                await conn.run_sync(_run_migrations)
+
+    await seed_defaults()
+
+async def seed_defaults():
     async with AsyncSessionLocal() as session:
         # Create default app settings
-        result = await session.execute(select(AppSettings))
-        if not result.scalars().first():
+        result = await session.execute(select(AppSettings.id).limit(1))
+        if not result.first():
             session.add(AppSettings(
                 site_title="HomePageScan",
                 site_icon_url=None,
@@ -122,22 +277,28 @@ async def init_db():
                 accent_color="#3b82f6"
             ))
         
-        # Create default user
-        from auth import get_password_hash
-        result = await session.execute(select(User).where(User.username == "admin"))
-        if not result.scalars().first():
-            session.add(User(username="admin", hashed_password=get_password_hash("admin")))
+        # Create default admin - use ADMIN_PASSWORD from environment, fallback to 'admin'.
+        # bcrypt is slow on purpose, so only hash when the user actually has to be created.
+        result = await session.execute(select(User.id).where(User.username == "admin"))
+        if not result.first():
+            from auth import get_password_hash
+            session.add(User(username="admin", hashed_password=get_password_hash(os.environ.get("ADMIN_PASSWORD", "admin"))))
         
         # Create default profile
-        result = await session.execute(select(Profile).where(Profile.name == "Default"))
-        if not result.scalars().first():
+        result = await session.execute(select(Profile.id).where(Profile.name == "Default"))
+        if not result.first():
             session.add(Profile(
                 name="Default", 
                 scan_target="127.0.0.1",
                 is_guest_default=True
             ))
-            
-        await session.commit()
+        
+        if session.new:
+            try:
+                await session.commit()
+            except IntegrityError:
+                # Another worker seeded the defaults at the same time
+                await session.rollback()
 
 async def get_db():
     async with AsyncSessionLocal() as session:
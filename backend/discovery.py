@@ -0,0 +1,317 @@
+"""
+Passive service discovery via mDNS (Bonjour/Avahi) and SSDP (UPnP).
+
+Many devices advertise their web UI with a friendly name. We send one query of
+each kind, listen for the answers and for unsolicited announcements, and
+yield endpoints for the normal probe/upsert path:
+
+    {"ip": "192.168.1.10", "port": 5000, "scheme": "http", "name": "My NAS", "source": "mdns"}
+
+The mDNS and SSDP queries use plain asyncio sockets; httpx (already used by
+the scanner) fetches the UPnP device descriptions. The multicast addresses are
+parameters, so unicast stand-ins on 127.0.0.1 can replace them (e.g. in tests).
+"""
+import asyncio
+import logging
+import os
+import socket
+import struct
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+MDNS_ADDR = ("224.0.0.251", 5353)
+SSDP_ADDR = ("239.255.255.250", 1900)
+MDNS_SERVICE_TYPES = os.environ.get(
+    "MDNS_SERVICE_TYPES", "_http._tcp.local,_https._tcp.local"
+).split(",")
+DISCOVERY_TIMEOUT = float(os.environ.get("DISCOVERY_TIMEOUT", "3.0"))
+
+# DNS record types
+TYPE_A = 1
+TYPE_PTR = 12
+TYPE_TXT = 16
+TYPE_SRV = 33
+
+# --- Minimal DNS message handling (RFC 1035 / RFC 6762) ---
+
+def encode_name(name: str) -> bytes:
+    out = b""
+    for label in name.rstrip(".").split("."):
+        raw = label.encode("utf-8")
+        out += bytes([len(raw)]) + raw
+    return out + b"\0"
+
+def build_query(names, qtype: int = TYPE_PTR) -> bytes:
+    header = struct.pack("!HHHHHH", 0, 0, len(names), 0, 0, 0)
+    # 0x8000 in the class field asks for a unicast response (the "QU" bit)
+    return header + b"".join(encode_name(n) + struct.pack("!HH", qtype, 0x8001) for n in names)
+
+def read_name(data: bytes, offset: int):
+    """Read a possibly compressed name. Returns (name, offset after the name)."""
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            jumps += 1
+            if jumps > 20:
+                raise ValueError("DNS name compression loop")
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(data[offset:offset + length].decode("utf-8", errors="replace"))
+        offset += length
+    return ".".join(labels), (end if end is not None else offset)
+
+def parse_dns(data: bytes):
+    """Return answer/authority/additional records as (name, type, value) tuples."""
+    qdcount, ancount, nscount, arcount = struct.unpack("!HHHH", data[4:12])
+    offset = 12
+    for _ in range(qdcount):
+        _, offset = read_name(data, offset)
+        offset += 4
+
+    records = []
+    for _ in range(ancount + nscount + arcount):
+        name, offset = read_name(data, offset)
+        rtype, _, _, rdlength = struct.unpack("!HHIH", data[offset:offset + 10])
+        offset += 10
+        rdata_start = offset
+        offset += rdlength
+
+        if rtype == TYPE_PTR:
+            value, _ = read_name(data, rdata_start)
+        elif rtype == TYPE_SRV:
+            _, _, port = struct.unpack("!HHH", data[rdata_start:rdata_start + 6])
+            target, _ = read_name(data, rdata_start + 6)
+            value = (target, port)
+        elif rtype == TYPE_A and rdlength == 4:
+            value = socket.inet_ntoa(data[rdata_start:offset])
+        elif rtype == TYPE_TXT:
+            value, pos = [], rdata_start
+            while pos < offset:
+                length = data[pos]
+                value.append(data[pos + 1:pos + 1 + length].decode("utf-8", errors="replace"))
+                pos += 1 + length
+        else:
+            continue
+        records.append((name.lower(), rtype, value))
+    return records
+
+class MdnsState:
+    """Accumulates records across packets and emits an endpoint once an instance is complete."""
+
+    def __init__(self, service_types):
+        self.service_types = {t.lower().rstrip(".") for t in service_types}
+        self.instances = {}   # instance name -> service type
+        self.srv = {}         # instance (lower) -> (target, port)
+        self.hosts = {}       # target (lower) -> ip
+        self.sources = {}     # instance (lower) -> source ip of the packet
+        self.emitted = set()
+
+    def feed(self, data: bytes, source_ip: str):
+        endpoints = []
+        for name, rtype, value in parse_dns(data):
+            if rtype == TYPE_PTR and name.lower() in self.service_types:
+                self.instances[value] = name.lower()
+                self.sources.setdefault(value.lower(), source_ip)
+            elif rtype == TYPE_SRV:
+                self.srv[name] = value
+                self.sources.setdefault(name, source_ip)
+            elif rtype == TYPE_A:
+                self.hosts[name] = value
+
+        for instance, service_type in self.instances.items():
+            key = instance.lower()
+            if key in self.emitted or key not in self.srv:
+                continue
+            target, port = self.srv[key]
+            # Responders usually add the A record; otherwise the sender is the host
+            ip = self.hosts.get(target.lower()) or self.sources.get(key)
+            if not ip:
+                continue
+            self.emitted.add(key)
+            endpoints.append({
+                "ip": ip,
+                "port": port,
+                "scheme": "https" if service_type.startswith("_https.") else "http",
+                # "My NAS._http._tcp.local" -> "My NAS"
+                "name": instance[:len(instance) - len(service_type) - 1] if instance.lower().endswith("." + service_type) else instance,
+                "source": "mdns",
+            })
+        return endpoints
+
+# --- SSDP ---
+
+def build_msearch(addr) -> bytes:
+    return (
+        "M-SEARCH * HTTP/1.1\r\n"
+        f"HOST: {addr[0]}:{addr[1]}\r\n"
+        'MAN: "ssdp:discover"\r\n'
+        "MX: 2\r\n"
+        "ST: upnp:rootdevice\r\n"
+        "\r\n"
+    ).encode()
+
+def parse_ssdp(data: bytes) -> dict:
+    """Headers of an M-SEARCH response or NOTIFY, keys lowercased."""
+    headers = {}
+    for line in data.decode("utf-8", errors="replace").split("\r\n")[1:]:
+        key, sep, value = line.partition(":")
+        if sep:
+            headers[key.strip().lower()] = value.strip()
+    return headers
+
+async def describe_ssdp_device(client: httpx.AsyncClient, location: str):
+    """Fetch the UPnP description and return the device's web UI endpoint."""
+    name = None
+    target = location
+    try:
+        resp = await client.get(location)
+        root = ET.fromstring(resp.content)
+        name = root.findtext(".//{*}device/{*}friendlyName")
+        presentation = root.findtext(".//{*}device/{*}presentationURL")
+        if presentation:
+            target = urljoin(location, presentation.strip())
+    except Exception as e:
+        logger.debug(f"SSDP description {location} failed: {e}")
+
+    parsed = urlparse(target)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return None
+    return {
+        "ip": parsed.hostname,
+        "port": parsed.port or (443 if parsed.scheme == "https" else 80),
+        "scheme": parsed.scheme,
+        "name": name,
+        "source": "ssdp",
+    }
+
+# --- Sockets ---
+
+class _Collector(asyncio.DatagramProtocol):
+    def __init__(self, queue: asyncio.Queue, kind: str):
+        self.queue = queue
+        self.kind = kind
+
+    def datagram_received(self, data, addr):
+        self.queue.put_nowait((self.kind, data, addr[0]))
+
+def _query_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+    sock.bind(("", 0))
+    sock.setblocking(False)
+    return sock
+
+def _listen_socket(addr) -> socket.socket:
+    """Join a multicast group to hear unsolicited announcements."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("", addr[1]))
+    mreq = struct.pack("4s4s", socket.inet_aton(addr[0]), socket.inet_aton("0.0.0.0"))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    sock.setblocking(False)
+    return sock
+
+async def discover_endpoints(timeout: float = DISCOVERY_TIMEOUT, mdns_addr=MDNS_ADDR, ssdp_addr=SSDP_ADDR,
+                             service_types=MDNS_SERVICE_TYPES, listen: bool = True):
+    """
+    Query mDNS and SSDP and yield endpoints as they are found, for `timeout` seconds.
+    Pass mdns_addr/ssdp_addr=None to skip one protocol, listen=False to skip joining
+    the multicast groups (only answers to our own queries are read).
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    transports = []
+
+    def open_endpoint(sock, kind):
+        return loop.create_datagram_endpoint(lambda: _Collector(queue, kind), sock=sock)
+
+    mdns = MdnsState(service_types)
+    query = build_query(service_types)
+    for kind, addr, payload in (("mdns", mdns_addr, query), ("ssdp", ssdp_addr, build_msearch(ssdp_addr or SSDP_ADDR))):
+        if not addr:
+            continue
+        transport, _ = await open_endpoint(_query_socket(), kind)
+        transports.append((transport, addr, payload))
+        if listen:
+            try:
+                listener, _ = await open_endpoint(_listen_socket(addr), kind)
+                transports.append((listener, None, None))
+            except OSError as e:
+                logger.info(f"Not listening for {kind} announcements: {e}")
+
+    def send_queries():
+        for transport, addr, payload in transports:
+            if addr:
+                transport.sendto(payload, addr)
+
+    seen = set()
+    locations = set()
+    pending = set()
+    deadline = loop.time() + timeout
+    # mDNS suggests repeating the first query once, packets get lost
+    resend_at = loop.time() + min(1.0, timeout / 2)
+    send_queries()
+
+    async with httpx.AsyncClient(verify=False, timeout=2.0) as client:
+        async def describe(location):
+            queue.put_nowait(("endpoint", await describe_ssdp_device(client, location), None))
+
+        try:
+            while True:
+                now = loop.time()
+                if now >= deadline:
+                    # Let device descriptions that are still being fetched finish
+                    await asyncio.gather(*pending, return_exceptions=True)
+                    if queue.empty():
+                        break
+                    kind, data, source_ip = queue.get_nowait()
+                else:
+                    if resend_at and now >= resend_at:
+                        send_queries()
+                        resend_at = None
+                    wait = min(deadline, resend_at or deadline) - now
+                    try:
+                        kind, data, source_ip = await asyncio.wait_for(queue.get(), wait)
+                    except asyncio.TimeoutError:
+                        continue
+
+                found = []
+                try:
+                    if kind == "mdns":
+                        found = mdns.feed(data, source_ip)
+                    elif kind == "ssdp":
+                        location = parse_ssdp(data).get("location")
+                        if location and location not in locations:
+                            locations.add(location)
+                            task = asyncio.create_task(describe(location))
+                            pending.add(task)
+                            task.add_done_callback(pending.discard)
+                    elif kind == "endpoint" and data:
+                        found = [data]
+                except (ValueError, IndexError, struct.error) as e:
+                    logger.debug(f"Bad {kind} packet from {source_ip}: {e}")
+
+                for endpoint in found:
+                    key = (endpoint["ip"], endpoint["port"])
+                    if key not in seen:
+                        seen.add(key)
+                        yield endpoint
+        finally:
+            for task in pending:
+                task.cancel()
+            for transport, _, _ in transports:
+                transport.close()
@@ -0,0 +1,62 @@
+"""
+Executor layer for CPU-bound scan work.
+
+HTML parsing runs here instead of on the event loop that also serves the API and
+the SSE stream, so a large scan doesn't make the dashboard sluggish.
+
+Configuration (environment):
+    SCAN_EXECUTOR             "process" (default) or "thread"
+    SCAN_EXECUTOR_WORKERS     pool size, defaults to the CPU count (max 4)
+    SCAN_EXECUTOR_QUEUE_SIZE  jobs allowed to wait for a free worker
+"""
+import asyncio
+import os
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_KIND = os.environ.get("SCAN_EXECUTOR", "process").lower()
+EXECUTOR_WORKERS = int(os.environ.get("SCAN_EXECUTOR_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXECUTOR_QUEUE_SIZE = int(os.environ.get("SCAN_EXECUTOR_QUEUE_SIZE", "32"))
+
+_pool: Executor = None
+_slots: asyncio.Semaphore = None
+_slots_loop = None
+
+def get_pool() -> Executor:
+    """Create the pool on first use so importing this module stays cheap."""
+    global _pool
+    if _pool is None:
+        workers = max(1, EXECUTOR_WORKERS)
+        if EXECUTOR_KIND == "process":
+            try:
+                _pool = ProcessPoolExecutor(max_workers=workers)
+            except (OSError, NotImplementedError) as e:
+                # e.g. no /dev/shm in some containers
+                logger.warning(f"Process pool unavailable ({e}), falling back to threads")
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan-cpu")
+        logger.info(f"Scan executor: {type(_pool).__name__} with {workers} workers")
+    return _pool
+
+def _get_slots() -> asyncio.Semaphore:
+    # Bounded queue: running jobs + waiting jobs. Callers beyond that wait on the
+    # semaphore (cheap) instead of piling work into the pool's unbounded queue.
+    global _slots, _slots_loop
+    loop = asyncio.get_running_loop()
+    if _slots is None or _slots_loop is not loop:
+        _slots = asyncio.Semaphore(max(1, EXECUTOR_WORKERS) + max(0, EXECUTOR_QUEUE_SIZE))
+        _slots_loop = loop
+    return _slots
+
+async def run_cpu_bound(fn, *args):
+    """Run fn(*args) in the pool. fn and args must be picklable for the process pool."""
+    async with _get_slots():
+        return await asyncio.get_running_loop().run_in_executor(get_pool(), fn, *args)
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
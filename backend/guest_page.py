@@ -0,0 +1,184 @@
+"""
+Pre-rendered guest homepage.
+
+Guests only ever see the is_guest_default profile, so instead of booting the SPA
+and calling /api/settings, /api/profiles, /api/services and the icons, they can
+get a self-contained HTML snapshot (styles and icons inlined) that nginx serves
+straight from disk at /guest/.
+
+The snapshot is written to static/guest/index.html at startup and re-rendered
+(debounced) after any commit that touches Service, Profile or AppSettings, as
+seen by the change feed (change_feed.commit_hooks).
+"""
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from urllib.parse import urlparse
+
+from jinja2 import Environment
+from sqlalchemy.future import select
+
+import change_feed
+import database
+import icon_bundle
+from database import Service, Profile, AppSettings
+
+logger = logging.getLogger(__name__)
+
+GUEST_DIR = os.path.join("static", "guest")
+GUEST_PAGE = os.path.join(GUEST_DIR, "index.html")
+# Changes within this window are rendered once
+RENDER_DELAY = float(os.environ.get("GUEST_RENDER_DELAY", "1.0"))
+
+TEMPLATE = Environment(autoescape=True).from_string("""<!DOCTYPE html>
+<html lang="en"{% if settings.theme_mode == 'dark' %} class="dark"{% endif %}>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<meta name="generator" content="HomePageScan guest snapshot {{ generated_at }}">
+<title>{{ settings.site_title }}</title>
+{% if site_icon %}<link rel="icon" href="{{ site_icon }}">{% endif %}
+<style>
+:root { --accent: {{ settings.accent_color }}; --bg: #f8fafc; --card: #ffffff; --border: #e2e8f0; --text: #1e293b; --muted: #64748b; --tile: #f1f5f9; }
+{% if settings.theme_mode == 'auto' %}@media (prefers-color-scheme: dark) { :root { --bg: #0f172a; --card: #1e293b; --border: #334155; --text: #f1f5f9; --muted: #94a3b8; --tile: #0f172a; } }{% endif %}
+html.dark { --bg: #0f172a; --card: #1e293b; --border: #334155; --text: #f1f5f9; --muted: #94a3b8; --tile: #0f172a; }
+* { box-sizing: border-box; }
+body { margin: 0; font-family: system-ui, -apple-system, "Segoe UI", Roboto, sans-serif; background: var(--bg); color: var(--text); }
+header { display: flex; align-items: center; gap: .75rem; padding: 1rem 1.5rem; border-bottom: 1px solid var(--border); background: var(--card); }
+header img { width: 2rem; height: 2rem; border-radius: .5rem; object-fit: cover; }
+header h1 { margin: 0; font-size: 1.25rem; }
+main { max-width: 80rem; margin: 0 auto; padding: 1.5rem; }
+.grid { display: grid; gap: 1rem; grid-template-columns: repeat(auto-fill, minmax({{ tile_width }}, 1fr)); }
+.list { display: grid; gap: .5rem; grid-template-columns: 1fr; }
+.card { display: flex; flex-direction: column; align-items: center; gap: .5rem; padding: 1.25rem; background: var(--card); border: 1px solid var(--border); border-radius: 1rem; text-decoration: none; color: inherit; }
+.list .card { flex-direction: row; padding: .75rem 1rem; }
+.card:hover { border-color: var(--accent); }
+.icon { width: 3.5rem; height: 3.5rem; border-radius: .75rem; background: var(--tile); display: flex; align-items: center; justify-content: center; overflow: hidden; flex-shrink: 0; }
+.list .icon { width: 2.5rem; height: 2.5rem; }
+.icon img { width: 100%; height: 100%; object-fit: contain; }
+.name { font-weight: 700; font-size: .875rem; text-align: center; }
+.host { font-size: .75rem; color: var(--muted); }
+.list .name, .list .host { text-align: left; }
+.wan { font-size: .75rem; color: var(--accent); text-decoration: none; }
+.empty { color: var(--muted); text-align: center; padding: 4rem 0; }
+</style>
+</head>
+<body>
+<header>
+{% if site_icon %}<img src="{{ site_icon }}" alt="">{% endif %}
+<h1>{{ settings.site_title }}</h1>
+</header>
+<main>
+{% if services %}
+<div class="{{ 'list' if settings.view_mode == 'list' else 'grid' }}">
+{% for s in services %}
+<div class="card">
+<a class="icon" href="{{ s.href }}">{% if s.icon %}<img src="{{ s.icon }}" alt="">{% endif %}</a>
+<div>
+<a class="name" href="{{ s.href }}" style="color: inherit; text-decoration: none; display: block;">{{ s.name }}</a>
+<div class="host">{{ s.host }}</div>
+{% if s.wan_url %}<a class="wan" href="{{ s.wan_url }}">WAN</a>{% endif %}
+</div>
+</div>
+{% endfor %}
+</div>
+{% else %}
+<p class="empty">No services</p>
+{% endif %}
+</main>
+</body>
+</html>
+""")
+
+TILE_WIDTHS = {"small": "10rem", "medium": "14rem", "large": "20rem"}
+
+def _host(url: str) -> str:
+    try:
+        return urlparse(url).netloc or url
+    except ValueError:
+        return url
+
+async def render_guest_page():
+    """Write the guest snapshot, or remove it when no profile is public."""
+    async with database.AsyncSessionLocal() as db:
+        settings = (await db.execute(select(AppSettings))).scalars().first() or AppSettings(
+            site_title="HomePageScan", view_mode="grid", grid_size="medium", theme_mode="auto", accent_color="#3b82f6"
+        )
+        profile = (await db.execute(select(Profile).where(Profile.is_guest_default == True))).scalars().first()
+        if not profile:
+            if os.path.exists(GUEST_PAGE):
+                os.remove(GUEST_PAGE)
+            return
+
+        # Same order as /api/services
+        res = await db.execute(
+            select(Service)
+            .where(Service.profile_id == profile.id)
+            .where(Service.is_visible == True)
+            .order_by(Service.sort_order.desc(), Service.port.asc())
+        )
+        rows = res.scalars().all()
+        _, body = await icon_bundle.get_bundle(db, profile.id)
+        icons = json.loads(body)["icons"]
+
+    if settings.default_sort_by == "name":
+        rows = sorted(rows, key=lambda s: (s.custom_name or s.title or "").lower())
+    elif settings.default_sort_by == "port":
+        rows = sorted(rows, key=lambda s: s.port)
+
+    services = []
+    for s in rows:
+        href = s.lan_url or s.url
+        services.append({
+            "name": s.custom_name or s.title or "Unknown",
+            "href": href,
+            "host": _host(href or ""),
+            "wan_url": s.wan_url,
+            "icon": icons.get(s.icon_url) or (s.icon_url if s.icon_url and s.icon_url.startswith("http") else None),
+        })
+
+    # Inline the site icon too, so the page needs no other request
+    site_icon = icon_bundle.inline_icon(settings.site_icon_url) or settings.site_icon_url
+
+    html = TEMPLATE.render(
+        settings=settings,
+        site_icon=site_icon,
+        services=services,
+        tile_width=TILE_WIDTHS.get(settings.grid_size, TILE_WIDTHS["medium"]),
+        generated_at=datetime.utcnow().isoformat(timespec="seconds"),
+    )
+
+    # Atomic replace so nginx never serves a half-written file
+    os.makedirs(GUEST_DIR, exist_ok=True)
+    tmp_path = f"{GUEST_PAGE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(html)
+    os.replace(tmp_path, GUEST_PAGE)
+
+# --- Debounced re-rendering ---
+_pending = False
+_task = None
+
+def schedule_render():
+    global _pending, _task
+    _pending = True
+    if _task is None or _task.done():
+        try:
+            _task = asyncio.get_running_loop().create_task(_render_loop())
+        except RuntimeError:
+            pass  # No event loop (e.g. a sync script), next startup will render
+
+async def _render_loop():
+    global _pending
+    while _pending:
+        await asyncio.sleep(RENDER_DELAY)
+        _pending = False
+        try:
+            await render_guest_page()
+        except Exception as e:
+            logger.warning(f"Guest page render failed: {e}")
+
+# Re-render after every commit the change feed recorded
+change_feed.commit_hooks.append(schedule_render)
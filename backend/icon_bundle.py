@@ -0,0 +1,102 @@
+"""
+Per-profile icon bundle: every local icon of a profile as data URIs in one JSON
+response, so the dashboard doesn't make one /static/icons request per card.
+
+    {"version": "<content hash>", "icons": {"/static/icons/x.png": "data:image/png;base64,..."}}
+
+Bundles are cached per profile and rebuilt only when the set of icons or one of
+the icon files (mtime/size) changes. The version is a hash of the content, so it
+doubles as the ETag and as a cache-busting ?v= parameter.
+"""
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+from typing import Dict, List, Tuple
+
+from sqlalchemy.future import select
+
+from database import Service
+
+ICON_PREFIX = "/static/icons/"
+
+# profile_id -> (stamp, version, body)
+_cache: Dict[int, Tuple[tuple, str, bytes]] = {}
+
+def _icon_path(icon_url: str):
+    """Local file for a /static/icons/... URL, or None for external/invalid URLs."""
+    if not icon_url or not icon_url.startswith(ICON_PREFIX):
+        return None
+    name = os.path.basename(icon_url[len(ICON_PREFIX):])
+    if not name or name in (".", ".."):
+        return None
+    return os.path.join("static", "icons", name)
+
+def _mime_type(path: str, data: bytes) -> str:
+    # Sniff first, downloaded favicons are often named after the URL, not the format
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data.startswith(b"\x00\x00\x01\x00"):
+        return "image/x-icon"
+    if data.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if data.startswith(b"GIF8"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if b"<svg" in data[:512]:
+        return "image/svg+xml"
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+def _stamp(icon_urls: List[str]) -> tuple:
+    """Cheap change detector: (url, mtime, size) for every existing icon file."""
+    stamp = []
+    for url in icon_urls:
+        path = _icon_path(url)
+        try:
+            st = os.stat(path)
+        except (OSError, TypeError):
+            continue
+        stamp.append((url, st.st_mtime_ns, st.st_size))
+    return tuple(stamp)
+
+def inline_icon(icon_url: str):
+    """Data URI for a /static/icons/... URL, or None if there is no such file."""
+    path = _icon_path(icon_url)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except (OSError, TypeError):
+        return None
+    return f"data:{_mime_type(path, data)};base64,{base64.b64encode(data).decode('ascii')}"
+
+def _build(stamp: tuple) -> Tuple[str, bytes]:
+    icons = {}
+    for url, _, _ in stamp:
+        data_uri = inline_icon(url)
+        if data_uri:
+            icons[url] = data_uri
+
+    version = hashlib.sha256(json.dumps(icons, sort_keys=True).encode()).hexdigest()[:16]
+    body = json.dumps({"version": version, "icons": icons}, sort_keys=True).encode()
+    return version, body
+
+async def get_bundle(db, profile_id: int) -> Tuple[str, bytes]:
+    """Return (version, JSON body) for the profile, rebuilding only if its icons changed."""
+    res = await db.execute(
+        select(Service.icon_url)
+        .where(Service.profile_id == profile_id)
+        .where(Service.is_visible == True)
+        .where(Service.icon_url.like(ICON_PREFIX + "%"))
+        .distinct()
+    )
+    stamp = _stamp(sorted(res.scalars().all()))
+
+    cached = _cache.get(profile_id)
+    if cached and cached[0] == stamp:
+        return cached[1], cached[2]
+
+    version, body = _build(stamp)
+    _cache[profile_id] = (stamp, version, body)
+    return version, body
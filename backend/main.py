@@ -1,7 +1,7 @@
 from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, UploadFile, File, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import delete, update
@@ -11,8 +11,17 @@ from schemas import (
     ProfileCreate, ProfileResponse, ProfileUpdate,
     AppSettingsResponse, AppSettingsUpdate, ReorderRequest
 )
-from auth import verify_password, get_password_hash, create_access_token, get_current_user, get_current_user_optional
-from scanner import run_scan_task, NMAP_BIN
+from auth import (
+    verify_password, get_password_hash, create_access_token, get_current_user, get_current_user_optional,
+    oauth2_scheme_optional, create_stream_ticket, get_stream_ticket_user, STREAM_TICKET_EXPIRE_SECONDS
+)
+from scanner import run_scan_task, get_nmap_bin
+import executor
+import transfer
+import icon_bundle
+import guest_page
+import change_feed
+from scan_state import load_backend, ScanReporter, WORKER_ID
 import shutil 
 import os
 import logging
@@ -38,49 +47,32 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 
 import database
 
-# Global scan status for SSE
-scan_status = {
-    "is_scanning": False,
-    "target": "",
-    "progress": 0,
-    "logs": [],
-    "completed": False
-}
-
-def add_scan_log(message: str):
-    scan_status["logs"].append(message)
-    if len(scan_status["logs"]) > 100:
-        scan_status["logs"] = scan_status["logs"][-50:]
+# Scan status for SSE, shared by all API workers (see scan_state.py)
+scan_state = load_backend()
 
 @app.on_event("startup")
 async def on_startup():
     await init_db()
-    async with database.AsyncSessionLocal() as db:
-        # Default Admin - use ADMIN_PASSWORD from environment, fallback to 'admin'
-        admin_password = os.environ.get("ADMIN_PASSWORD", "admin")
-        res = await db.execute(select(User).where(User.username == "admin"))
-        existing_admin = res.scalars().first()
-        if not existing_admin:
-            db.add(User(username="admin", hashed_password=get_password_hash(admin_password)))
-            logging.info(f"Created admin user with password from environment")
-        
-        # Default Profile
-        res_prof = await db.execute(select(Profile).where(Profile.name == "Default"))
-        if not res_prof.scalars().first():
-            db.add(Profile(name="Default", site_title="HomePageScan", scan_target="127.0.0.1"))
-            
-        await db.commit()
+    # Look for nmap in the background so startup doesn't wait on it
+    asyncio.get_running_loop().run_in_executor(None, get_nmap_bin)
+    # Refresh the static guest page (data may have changed while we were down)
+    guest_page.schedule_render()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    executor.shutdown()
 
 @app.get("/")
 def read_root():
     return {"message": "HomePageScan V2 API Running."}
 
 @app.get("/api/health")
-def health_check():
+async def health_check():
+    nmap_bin = await asyncio.to_thread(get_nmap_bin)
     return {
         "status": "ok",
-        "nmap_found": bool(NMAP_BIN),
-        "nmap_path": NMAP_BIN,
+        "nmap_found": bool(nmap_bin),
+        "nmap_path": nmap_bin,
     }
 
 # --- Auth ---
@@ -226,6 +218,22 @@ async def read_services(profile_id: int = 1, db: AsyncSession = Depends(get_db))
     )
     return result.scalars().all()
 
+@app.get("/api/profiles/{profile_id}/icons")
+async def get_icon_bundle(profile_id: int, request: Request, v: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    """All local icons of a profile as data URIs, in one cacheable response."""
+    version, body = await icon_bundle.get_bundle(db, profile_id)
+    etag = f'"{version}"'
+    headers = {"ETag": etag}
+    if v == version:
+        # Versioned URL: content can never change under it
+        headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        headers["Cache-Control"] = "no-cache"
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.post("/api/services/{service_id}")
 async def update_service(
     service_id: int, 
@@ -329,6 +337,51 @@ async def add_service_manual(data: dict, db: AsyncSession = Depends(get_db), use
     await db.refresh(new_service)
     return new_service
 
+# --- Bulk Export / Import ---
+@app.get("/api/profiles/{profile_id}/export")
+async def export_profile(profile_id: int, format: str = "ndjson", include_icons: bool = True, user: User = Depends(get_current_user)):
+    if format not in ("ndjson", "json"):
+        raise HTTPException(400, "format must be 'ndjson' or 'json'")
+    # Own session: a get_db one would stay open while the export streams
+    async with database.AsyncSessionLocal() as db:
+        res = await db.execute(select(Profile.id).where(Profile.id == profile_id))
+        if not res.first():
+            raise HTTPException(404, "Profile not found")
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return StreamingResponse(
+        transfer.export_stream(profile_id, format, include_icons),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.{format}"'}
+    )
+
+@app.post("/api/profiles/{profile_id}/import")
+async def import_profile(
+    profile_id: int,
+    request: Request,
+    on_conflict: str = "update",
+    import_settings: bool = False,
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_current_user)
+):
+    """Import NDJSON (or an export in json format) into a profile, streamed from the request body."""
+    if on_conflict not in ("update", "skip"):
+        raise HTTPException(400, "on_conflict must be 'update' or 'skip'")
+    res = await db.execute(select(Profile.id).where(Profile.id == profile_id))
+    if not res.first():
+        raise HTTPException(404, "Profile not found")
+    
+    try:
+        # Validate the whole upload first, so a bad record can't leave half an import behind
+        spool = await transfer.spool_records(transfer.iter_records(request.stream()))
+        with spool:
+            stats = await transfer.import_records(
+                profile_id, transfer.iter_spooled(spool), on_conflict, import_settings
+            )
+    except ValueError as e:
+        # json.JSONDecodeError is a ValueError too
+        raise HTTPException(400, f"Invalid import data: {e}")
+    return stats
+
 # --- Scan with SSE Progress ---
 @app.post("/api/scan")
 async def trigger_scan(
@@ -336,44 +389,45 @@ async def trigger_scan(
     background_tasks: BackgroundTasks,
     user: User = Depends(get_current_user)
 ):
-    global scan_status
-    scan_status = {
-        "is_scanning": True,
-        "target": scan_req.target_ip,
-        "progress": 0,
-        "logs": [f"Starting scan for {scan_req.target_ip}..."],
-        "completed": False
-    }
-    background_tasks.add_task(run_scan_with_status, scan_req.target_ip, scan_req.profile_id)
+    if scan_req.mode not in ("ports", "passive", "both"):
+        raise HTTPException(400, "mode must be 'ports', 'passive' or 'both'")
+    # The worker that handles this request owns the scan until it finishes
+    job_id = await scan_state.try_start(scan_req.target_ip, scan_req.profile_id, WORKER_ID)
+    if job_id is None:
+        raise HTTPException(409, "A scan is already running")
+    reporter = ScanReporter(scan_state, job_id)
+    reporter.log(f"Starting scan for {scan_req.target_ip}...")
+    background_tasks.add_task(run_scan_with_status, scan_req.target_ip, scan_req.profile_id, reporter, scan_req.mode, scan_req.resolve_names, scan_req.use_cache)
     return {"message": f"Scan started for {scan_req.target_ip}"}
 
-async def run_scan_with_status(target_ip: str, profile_id: int):
-    global scan_status
+async def run_scan_with_status(target_ip: str, profile_id: int, reporter: ScanReporter, mode: str = "ports", resolve_names: bool = False,
+                               use_cache: bool = True):
+    reporter.start()
     try:
-        add_scan_log(f"Initializing Nmap scan on {target_ip}...")
-        scan_status["progress"] = 5
+        method = {"ports": "Nmap", "passive": "mDNS/SSDP", "both": "Nmap + mDNS/SSDP"}[mode]
+        reporter.log(f"Initializing {method} scan on {target_ip}...")
+        reporter.progress = 5
         
-        await run_scan_task(target_ip, profile_id)
+        await run_scan_task(target_ip, profile_id, reporter, mode, resolve_names, use_cache)
         
-        scan_status["progress"] = 100
-        add_scan_log("Scan completed successfully!")
+        reporter.progress = 100
+        reporter.log("Scan completed successfully!")
     except Exception as e:
-        add_scan_log(f"Scan error: {str(e)}")
+        reporter.log(f"Scan error: {str(e)}")
     finally:
-        scan_status["is_scanning"] = False
-        scan_status["completed"] = True
+        await reporter.close()
 
 @app.get("/api/scan/status")
 async def get_scan_status():
-    return scan_status
+    return await scan_state.get_status()
 
 @app.get("/api/scan/stream")
 async def scan_stream():
     async def event_generator():
         while True:
-            data = json.dumps(scan_status)
-            yield f"data: {data}\n\n"
-            if scan_status["completed"] and not scan_status["is_scanning"]:
+            status = await scan_state.get_status()
+            yield f"data: {json.dumps(status)}\n\n"
+            if status["completed"] and not status["is_scanning"]:
                 break
             await asyncio.sleep(1)
     
@@ -387,6 +441,45 @@ async def scan_stream():
         }
     )
 
+# --- Live change feed (see change_feed.py) ---
+@app.post("/api/changes/ticket")
+async def changes_ticket(user: User = Depends(get_current_user)):
+    """Short-lived ticket for /api/changes/stream?ticket=..., EventSource can't send the Authorization header."""
+    return {"ticket": create_stream_ticket(user.username), "expires_in": STREAM_TICKET_EXPIRE_SECONDS}
+
+@app.get("/api/changes/stream")
+async def changes_stream(request: Request, since: Optional[int] = None, profile_id: Optional[int] = None,
+                         ticket: Optional[str] = None, token: Optional[str] = Depends(oauth2_scheme_optional)):
+    # EventSource reconnects send the last id they saw
+    last_event_id = request.headers.get("last-event-id")
+    if since is None and last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    # Not a get_db dependency: that session would stay open for as long as the stream runs
+    user = None
+    if ticket or token:
+        async with database.AsyncSessionLocal() as db:
+            if ticket:
+                user = await get_stream_ticket_user(ticket, db)
+            else:
+                user = await get_current_user_optional(token, db)
+    # Bad or expired credentials (e.g. an EventSource reconnecting with an old ticket) get
+    # told so, instead of quietly being served the guest view
+    if (ticket or token) and user is None:
+        stream = change_feed.unauthorized()
+    else:
+        stream = change_feed.feed.stream(since, profile_id, guest=user is None)
+
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 # --- Upload ---
 @app.post("/api/upload")
 async def upload_icon(file: UploadFile = File(...), user: User = Depends(get_current_user)):
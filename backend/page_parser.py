@@ -0,0 +1,46 @@
+"""
+CPU-bound page parsing used by the scanner.
+
+Everything in here is a plain top-level function taking and returning picklable
+values so it can run inside a process pool (see executor.py) without touching
+the event loop, the database or the network.
+"""
+from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
+from urllib.parse import urljoin
+import warnings
+
+# Suppress BeautifulSoup warnings (also needed inside pool worker processes)
+warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
+
+def decode_body(content: bytes, charset: str = None) -> str:
+    """Decode a response body using the declared charset, falling back to utf-8."""
+    if charset:
+        try:
+            return content.decode(charset, errors='replace')
+        except LookupError:
+            pass  # Unknown charset name sent by the server
+    return content.decode('utf-8', errors='replace')
+
+def parse_page(content: bytes, charset: str, url: str):
+    """
+    Extract title and icon URL from an HTML page.
+    Returns None if the body doesn't look like a web page.
+    """
+    soup = BeautifulSoup(decode_body(content, charset), 'html.parser')
+
+    # Must have <html> tag or <title> tag to be considered valid web page
+    if not soup.html and not soup.title:
+        return None
+
+    title = ""
+    if soup.title and soup.title.string:
+        title = soup.title.string.strip()
+
+    # Try to find favicon
+    icon_link = soup.find("link", rel=lambda x: x and 'icon' in x.lower())
+    if icon_link and icon_link.get('href'):
+        icon_url = urljoin(url, icon_link.get('href'))
+    else:
+        icon_url = urljoin(url, '/favicon.ico')
+
+    return {"title": title, "icon_url": icon_url}
@@ -0,0 +1,182 @@
+"""
+Batched hostname resolution with a persistent TTL cache.
+
+nmap runs with -n, so services only have bare IPs. When a scan asks for names,
+every newly seen host is resolved in the background while probing goes on.
+Three lookups run concurrently and the first one to answer wins:
+
+    dns      reverse DNS (PTR) through the system resolver
+    mdns     unicast reverse PTR query to the host's mDNS responder (port 5353)
+    netbios  NBSTAT node status query (port 137), Windows/Samba hosts
+
+Results, including "no name", go to the host_names table with a TTL, so
+rescans never resolve the same host twice. Every lookup has its own timeout,
+and the scan only waits for stragglers at the very end, bounded by
+RESOLVE_TIMEOUT.
+"""
+import asyncio
+import logging
+import os
+import socket
+import struct
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import delete
+from sqlalchemy.future import select
+
+import database
+from database import HostName
+from discovery import build_query, parse_dns, TYPE_PTR
+
+logger = logging.getLogger(__name__)
+
+RESOLVE_TIMEOUT = float(os.environ.get("RESOLVE_TIMEOUT", "2.0"))
+NAME_CACHE_TTL = int(os.environ.get("NAME_CACHE_TTL", str(24 * 3600)))
+# Hosts without a name are retried sooner
+NEGATIVE_CACHE_TTL = int(os.environ.get("NEGATIVE_CACHE_TTL", "3600"))
+
+# --- Lookups ---
+
+async def lookup_dns(ip: str) -> Optional[str]:
+    loop = asyncio.get_running_loop()
+    try:
+        host, _ = await loop.getnameinfo((ip, 0), socket.NI_NAMEREQD)
+    except (socket.gaierror, socket.herror, OSError):
+        return None
+    return host if host and host != ip else None
+
+class _FirstDatagram(asyncio.DatagramProtocol):
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+
+    def datagram_received(self, data, addr):
+        if not self.future.done():
+            self.future.set_result(data)
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+async def udp_request(ip: str, port: int, payload: bytes) -> bytes:
+    """Send one datagram and wait for the first reply (callers apply the timeout)."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(lambda: _FirstDatagram(future), remote_addr=(ip, port))
+    try:
+        transport.sendto(payload)
+        return await future
+    finally:
+        transport.close()
+
+def _reverse_name(ip: str) -> str:
+    return ".".join(reversed(ip.split("."))) + ".in-addr.arpa"
+
+async def lookup_mdns(ip: str, port: int = 5353) -> Optional[str]:
+    data = await udp_request(ip, port, build_query([_reverse_name(ip)], TYPE_PTR))
+    for _, rtype, value in parse_dns(data):
+        if rtype == TYPE_PTR and value:
+            # Keep the ".local" suffix, that's the name browsers on the LAN can open
+            return value.rstrip(".")
+    return None
+
+def build_nbstat_query() -> bytes:
+    # Wildcard name "*" padded with NULs, in NetBIOS first-level encoding
+    raw = b"*" + b"\0" * 15
+    encoded = b"".join(bytes([0x41 + (c >> 4), 0x41 + (c & 0x0F)]) for c in raw)
+    header = struct.pack("!HHHHHH", 0x4850, 0, 1, 0, 0, 0)
+    return header + bytes([32]) + encoded + b"\0" + struct.pack("!HH", 0x21, 1)
+
+def parse_nbstat(data: bytes) -> Optional[str]:
+    """First unique workstation (suffix 0x00) name of a node status response."""
+    # header(12) + name(34) + type/class/ttl/rdlength(10)
+    offset = 56
+    count = data[offset]
+    offset += 1
+    for _ in range(count):
+        entry = data[offset:offset + 18]
+        offset += 18
+        if len(entry) < 18:
+            break
+        name = entry[:15].decode("ascii", errors="replace").strip()
+        suffix = entry[15]
+        group = struct.unpack("!H", entry[16:18])[0] & 0x8000
+        if suffix == 0x00 and not group and name:
+            return name
+    return None
+
+async def lookup_netbios(ip: str, port: int = 137) -> Optional[str]:
+    return parse_nbstat(await udp_request(ip, port, build_nbstat_query()))
+
+LOOKUPS = (("dns", lookup_dns), ("mdns", lookup_mdns), ("netbios", lookup_netbios))
+
+async def resolve_host(ip: str, timeout: float = RESOLVE_TIMEOUT) -> Tuple[Optional[str], Optional[str]]:
+    """Run all lookups at once and return (name, source) of the first answer, or (None, None)."""
+    tasks = {asyncio.create_task(asyncio.wait_for(fn(ip), timeout)): source for source, fn in LOOKUPS}
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None and task.result():
+                    return task.result(), tasks[task]
+        return None, None
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Collect the losers' errors (refused ports etc.) so asyncio doesn't log them
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+# --- Cache + per-scan batching ---
+
+class NameResolver:
+    """
+    Per-scan resolver: submit() hosts as they are discovered, results() at the end.
+    Cached names (host_names table) are used without any network lookup.
+    """
+
+    def __init__(self):
+        self.cache: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.resolved: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+
+    async def load_cache(self):
+        now = datetime.utcnow()
+        async with database.AsyncSessionLocal() as db:
+            res = await db.execute(select(HostName).where(HostName.expires_at > now))
+            for row in res.scalars():
+                self.cache[row.ip] = (row.name, row.source)
+
+    def submit(self, ip: str):
+        if ip in self.cache or ip in self.tasks:
+            return
+        self.tasks[ip] = asyncio.create_task(self._resolve(ip))
+
+    async def _resolve(self, ip: str):
+        try:
+            self.resolved[ip] = await resolve_host(ip)
+        except Exception as e:
+            logger.debug(f"Name lookup for {ip} failed: {e}")
+            self.resolved[ip] = (None, None)
+
+    async def results(self) -> Dict[str, Tuple[str, str]]:
+        """Wait for outstanding lookups, store them in the cache and return ip -> (name, source)."""
+        if self.tasks:
+            # Each lookup already times out on its own, this is just a safety net
+            await asyncio.wait(list(self.tasks.values()), timeout=RESOLVE_TIMEOUT + 1)
+        await self._save()
+        names = {ip: entry for ip, entry in self.cache.items() if entry[0]}
+        names.update({ip: entry for ip, entry in self.resolved.items() if entry[0]})
+        return names
+
+    async def _save(self):
+        if not self.resolved:
+            return
+        now = datetime.utcnow()
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(delete(HostName).where(HostName.ip.in_(list(self.resolved))))
+            for ip, (name, source) in self.resolved.items():
+                ttl = NAME_CACHE_TTL if name else NEGATIVE_CACHE_TTL
+                db.add(HostName(ip=ip, name=name, source=source, resolved_at=now,
+                                expires_at=now + timedelta(seconds=ttl)))
+            await db.commit()
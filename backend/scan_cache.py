@@ -0,0 +1,73 @@
+"""
+Target-level scan result cache, shared by all profiles.
+
+Several profiles often point at the same server. The probe results of a scan
+(one dict per web service, as returned by probe_web_service) are stored under
+the scan target + port range + discovery method, so a scan of the same target
+for another profile within SCAN_CACHE_TTL seconds skips nmap and probing and
+only runs the per-profile upsert. N profiles cost one scan. Every profile
+gets an entry at most once: the profile that made it, or one that already
+got it, scans again (and refreshes the entry), so pressing scan a second
+time keeps meaning "look again". use_cache=False skips the cache outright.
+
+Entries live in the scan_cache table, so every API worker sees them.
+SCAN_CACHE_TTL=0 turns the cache off.
+"""
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete
+
+import database
+from database import ScanCache
+
+logger = logging.getLogger(__name__)
+
+SCAN_CACHE_TTL = int(os.environ.get("SCAN_CACHE_TTL", "300"))
+
+# Per-profile state that must not leak into other profiles' scans
+_PRIVATE_KEYS = ("unchanged",)
+
+def cache_key(target: str, ports: Optional[str], passive: bool) -> str:
+    """ports is the nmap port range, or None when nmap doesn't run."""
+    return f"{target.strip()}|ports={ports or '-'}|passive={int(passive)}"
+
+def _users(entry: ScanCache) -> set:
+    """Profiles that made or already got the entry."""
+    users = {int(p) for p in (entry.used_by or "").split(",") if p}
+    if entry.profile_id is not None:
+        users.add(entry.profile_id)
+    return users
+
+async def load(key: str, profile_id: int) -> Optional[Tuple[List[dict], float]]:
+    """Return (results, age in seconds) for a fresh entry this profile hasn't used yet, or None."""
+    if SCAN_CACHE_TTL <= 0:
+        return None
+    now = datetime.utcnow()
+    async with database.AsyncSessionLocal() as db:
+        entry = await db.get(ScanCache, key)
+        if not entry or entry.expires_at <= now or profile_id in _users(entry):
+            return None
+        try:
+            results = json.loads(entry.results)
+        except ValueError:
+            return None
+        # The next scan of this profile is a rescan and must look again
+        entry.used_by = ",".join(str(p) for p in sorted(_users(entry) | {profile_id}))
+        await db.commit()
+    return results, (now - entry.created_at).total_seconds()
+
+async def store(key: str, profile_id: int, results: List[dict]):
+    if SCAN_CACHE_TTL <= 0:
+        return
+    now = datetime.utcnow()
+    payload = json.dumps([{k: v for k, v in r.items() if k not in _PRIVATE_KEYS} for r in results])
+    async with database.AsyncSessionLocal() as db:
+        # Drop expired entries of other targets while we're at it
+        await db.execute(delete(ScanCache).where((ScanCache.key == key) | (ScanCache.expires_at <= now)))
+        db.add(ScanCache(key=key, results=payload, profile_id=profile_id, used_by=str(profile_id), created_at=now,
+                         expires_at=now + timedelta(seconds=SCAN_CACHE_TTL)))
+        await db.commit()
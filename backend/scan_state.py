@@ -0,0 +1,248 @@
+"""
+Shared scan state: progress, logs and which worker owns the running scan.
+
+The state used to live in module globals of main.py, which only works with a
+single uvicorn worker. Now every worker reads and writes it through a backend:
+
+    SCAN_STATE_BACKEND=sqlite   (default) tables in the app database, works with --workers N
+    SCAN_STATE_BACKEND=memory   process-local, single worker only
+    SCAN_STATE_BACKEND=pkg.module:ClassName   any ScanStateBackend subclass
+
+The scanner never talks to the backend directly. It gets a ScanReporter, which
+buffers log lines and progress in memory and flushes them (plus a heartbeat)
+every SCAN_STATE_FLUSH_INTERVAL seconds, so the scan loop doesn't wait on the DB.
+"""
+import abc
+import asyncio
+import importlib
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import delete, update, or_
+from sqlalchemy.future import select
+
+import database
+from database import ScanJob, ScanLog, ScanLease
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+FLUSH_INTERVAL = float(os.environ.get("SCAN_STATE_FLUSH_INTERVAL", "0.5"))
+# A scan whose owner hasn't sent a heartbeat for this long is considered dead
+LEASE_SECONDS = int(os.environ.get("SCAN_STATE_LEASE_SECONDS", "30"))
+MAX_LOGS = 50
+
+def idle_status() -> dict:
+    return {
+        "is_scanning": False,
+        "target": "",
+        "progress": 0,
+        "logs": [],
+        "completed": False
+    }
+
+class ScanStateBackend(abc.ABC):
+    """Interface for scan state storage. All methods are coroutines."""
+
+    @abc.abstractmethod
+    async def try_start(self, target: str, profile_id: int, owner: str) -> Optional[int]:
+        """Create a job owned by `owner` and return its id, or None if another live scan is running."""
+
+    @abc.abstractmethod
+    async def update(self, job_id: int, progress: int, logs: List[str]):
+        """Store progress, append log lines and renew the owner's lease."""
+
+    @abc.abstractmethod
+    async def finish(self, job_id: int):
+        """Mark the job completed and release the lease."""
+
+    @abc.abstractmethod
+    async def get_status(self) -> dict:
+        """Status of the latest job, in the shape of idle_status()."""
+
+class MemoryScanState(ScanStateBackend):
+    """Process-local state, equivalent to the old globals. Single worker only."""
+
+    def __init__(self):
+        self.job_id = 0
+        self.status = idle_status()
+
+    async def try_start(self, target, profile_id, owner):
+        if self.status["is_scanning"]:
+            return None
+        self.job_id += 1
+        self.status = {
+            "is_scanning": True,
+            "target": target,
+            "progress": 0,
+            "logs": [],
+            "completed": False
+        }
+        return self.job_id
+
+    async def update(self, job_id, progress, logs):
+        if job_id != self.job_id:
+            return
+        self.status["progress"] = progress
+        self.status["logs"] = (self.status["logs"] + logs)[-MAX_LOGS:]
+
+    async def finish(self, job_id):
+        if job_id != self.job_id:
+            return
+        self.status["is_scanning"] = False
+        self.status["completed"] = True
+
+    async def get_status(self):
+        return dict(self.status)
+
+class SQLiteScanState(ScanStateBackend):
+    """State stored in the app database (scan_jobs / scan_logs / scan_lease)."""
+
+    async def try_start(self, target, profile_id, owner):
+        now = datetime.utcnow()
+        async with database.AsyncSessionLocal() as db:
+            # Make sure the lease row exists; losing this race to another worker is fine
+            if not (await db.execute(select(ScanLease.id).where(ScanLease.id == 1))).first():
+                db.add(ScanLease(id=1))
+                try:
+                    await db.commit()
+                except Exception:
+                    await db.rollback()
+
+            job = ScanJob(target=target, profile_id=profile_id, owner=owner, progress=0,
+                          is_scanning=True, completed=False, started_at=now, heartbeat_at=now)
+            db.add(job)
+            await db.flush()
+
+            # Atomic compare-and-set: only one worker can take a free or expired lease
+            res = await db.execute(
+                update(ScanLease)
+                .where(ScanLease.id == 1)
+                .where(or_(ScanLease.owner.is_(None), ScanLease.expires_at < now))
+                .values(job_id=job.id, owner=owner, expires_at=now + timedelta(seconds=LEASE_SECONDS))
+            )
+            if res.rowcount != 1:
+                await db.rollback()
+                return None
+
+            # Jobs whose owner died without finishing
+            await db.execute(
+                update(ScanJob)
+                .where(ScanJob.is_scanning == True, ScanJob.id != job.id)
+                .values(is_scanning=False, completed=True)
+            )
+            # Only the latest job is ever shown, drop older logs
+            await db.execute(delete(ScanLog).where(ScanLog.job_id != job.id))
+            await db.commit()
+            return job.id
+
+    async def update(self, job_id, progress, logs):
+        now = datetime.utcnow()
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(
+                update(ScanJob).where(ScanJob.id == job_id).values(progress=progress, heartbeat_at=now)
+            )
+            await db.execute(
+                update(ScanLease)
+                .where(ScanLease.id == 1, ScanLease.job_id == job_id)
+                .values(expires_at=now + timedelta(seconds=LEASE_SECONDS))
+            )
+            for message in logs:
+                db.add(ScanLog(job_id=job_id, message=message))
+            await db.commit()
+
+    async def finish(self, job_id):
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(
+                update(ScanJob).where(ScanJob.id == job_id).values(is_scanning=False, completed=True)
+            )
+            await db.execute(
+                update(ScanLease)
+                .where(ScanLease.id == 1, ScanLease.job_id == job_id)
+                .values(job_id=None, owner=None, expires_at=None)
+            )
+            await db.commit()
+
+    async def get_status(self):
+        async with database.AsyncSessionLocal() as db:
+            res = await db.execute(select(ScanJob).order_by(ScanJob.id.desc()).limit(1))
+            job = res.scalars().first()
+            if not job:
+                return idle_status()
+
+            res = await db.execute(
+                select(ScanLog.message).where(ScanLog.job_id == job.id).order_by(ScanLog.id.desc()).limit(MAX_LOGS)
+            )
+            logs = list(reversed(res.scalars().all()))
+
+        is_scanning = job.is_scanning
+        completed = job.completed
+        if is_scanning and job.heartbeat_at < datetime.utcnow() - timedelta(seconds=LEASE_SECONDS):
+            # Owner stopped sending heartbeats (worker killed mid-scan)
+            is_scanning = False
+            completed = True
+            logs.append("Scan interrupted: the worker running it stopped responding.")
+
+        return {
+            "is_scanning": is_scanning,
+            "target": job.target,
+            "progress": job.progress,
+            "logs": logs,
+            "completed": completed
+        }
+
+class ScanReporter:
+    """Handed to the scanner: cheap synchronous log()/progress, flushed to the backend in the background."""
+
+    def __init__(self, backend: ScanStateBackend, job_id: int):
+        self.backend = backend
+        self.job_id = job_id
+        self.progress = 0
+        self._logs: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def log(self, message: str):
+        self._logs.append(message)
+
+    async def flush(self):
+        logs, self._logs = self._logs, []
+        try:
+            await self.backend.update(self.job_id, self.progress, logs)
+        except Exception as e:
+            logger.warning(f"Failed to store scan state: {e}")
+            self._logs = logs + self._logs
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+
+    def start(self):
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        await self.backend.finish(self.job_id)
+
+def load_backend(name: str = None) -> ScanStateBackend:
+    name = name or os.environ.get("SCAN_STATE_BACKEND", "sqlite")
+    if name == "sqlite":
+        return SQLiteScanState()
+    if name == "memory":
+        return MemoryScanState()
+    # Custom backend: "package.module:ClassName"
+    module_name, _, class_name = name.partition(":")
+    cls = getattr(importlib.import_module(module_name), class_name)
+    if not (isinstance(cls, type) and issubclass(cls, ScanStateBackend)):
+        raise TypeError(f"{name} is not a ScanStateBackend subclass")
+    # Instantiating fails here, at startup, if an abstract method is missing
+    return cls()
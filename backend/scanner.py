@@ -1,22 +1,26 @@
 import asyncio
 import os
 import shutil
-import nmap
+import functools
+import hashlib
+import ipaddress
+import socket
 import httpx
-from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urlparse
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import AsyncSessionLocal, Service
+from executor import run_cpu_bound
+from discovery import discover_endpoints
+from adaptive import HostController, HostControllers, INITIAL_TIMEOUT
+from page_parser import parse_page
+from resolver import NameResolver
+import scan_cache
 import logging
 import subprocess
 import aiofiles
 from datetime import datetime
 import re
-import warnings
-
-# Suppress BeautifulSoup warnings
-warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -50,44 +54,263 @@ def find_nmap_path():
 
     return None
 
-NMAP_BIN = find_nmap_path()
-nm = None
+@functools.lru_cache(maxsize=None)
+def get_nmap_bin():
+    """Locate nmap on first use instead of at import time (the Windows lookup spawns a subprocess)."""
+    path = find_nmap_path()
+    if path:
+        logger.info(f"Nmap found at: {path}")
+    else:
+        logger.error("Nmap binary NOT found. Scans will fail.")
+    return path
 
-if NMAP_BIN:
-    logger.info(f"Nmap found at: {NMAP_BIN}")
-    # We still initialize python-nmap just in case we need parsing utils, 
-    # but we will primarily use subprocess for scanning now.
-    try:
-        nm = nmap.PortScanner(nmap_search_path=[NMAP_BIN, 'nmap'])
-    except Exception:
-        pass
-else:
-    logger.error("Nmap binary NOT found. Scans will fail.")
-
-async def run_scan_task(target_ip: str, profile_id: int):
-    # Import log function from main if possible, or just print to stdout
-    # Since we are in a separate module, we can't easily import `add_scan_log` from main without circular import.
-    # We will assume main.py is monkey-patching or we redesign slightly.
-    # Ideally, main.py should pass a callback. But for now, let's just use a global queue or specialized logging.
-    # BETTER APPROACH: We just process and let the background task finish, 
-    # but to support REALTIME updates, we must communicate back to main.py.
-    # Python modules are singletons. We can import `add_scan_log` inside the function if main is already loaded.
-    
-    from main import add_scan_log, scan_status
-    
-    logger.info(f"Starting scan for {target_ip} on Profile {profile_id}")
+def _nmap_services_paths():
+    nmap_bin = get_nmap_bin()
+    if nmap_bin:
+        bin_dir = os.path.dirname(nmap_bin)
+        yield os.path.join(bin_dir, "nmap-services")  # Windows installs keep it next to nmap.exe
+        yield os.path.join(bin_dir, "..", "share", "nmap", "nmap-services")
+    yield "/usr/share/nmap/nmap-services"
+    yield "/usr/local/share/nmap/nmap-services"
+
+@functools.lru_cache(maxsize=None)
+def load_nmap_services() -> dict:
+    """
+    TCP port -> service name from nmap's nmap-services file. That's where the final
+    table gets its names without -sV, so "Discovered open port" lines can be
+    classified right away instead of waiting for the table.
+    """
+    best = {}
+    for path in _nmap_services_paths():
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) < 3 or line.startswith("#") or not parts[1].endswith("/tcp"):
+                        continue
+                    try:
+                        port, freq = int(parts[1][:-4]), float(parts[2])
+                    except ValueError:
+                        continue
+                    # Several names per port: nmap shows the most frequent one
+                    if port not in best or freq > best[port][1]:
+                        best[port] = (parts[0], freq)
+        except OSError:
+            continue
+        break
+    return {port: name for port, (name, _) in best.items()}
+
+# Pipeline tuning: how many probes run at once, how many discovered ports may
+# wait in line before nmap output reading is paused, and how DB writes are batched.
+PROBE_WORKERS = int(os.environ.get("SCAN_PROBE_WORKERS", "16"))
+PROBE_QUEUE_SIZE = int(os.environ.get("SCAN_PROBE_QUEUE_SIZE", "64"))
+DB_BATCH_SIZE = int(os.environ.get("SCAN_DB_BATCH_SIZE", "20"))
+DB_FLUSH_INTERVAL = float(os.environ.get("SCAN_DB_FLUSH_INTERVAL", "1.0"))
+
+# Ports nmap sweeps, also part of the shared scan cache key
+NMAP_PORTS = os.environ.get("SCAN_NMAP_PORTS", "1-65535")
+
+# "Discovered open port 80/tcp on 192.168.1.1" (only printed with -v)
+DISCOVERED_RE = re.compile(r"Discovered open port (\d+)/tcp on (\S+)")
+# Final table row: "80/tcp open http"
+TABLE_RE = re.compile(r"^(\d+)/tcp\s+open\s*(.*)$")
+
+# Timed-out probes are retried this many times with the host's backed-off timeout
+PROBE_RETRIES = int(os.environ.get("SCAN_PROBE_RETRIES", "1"))
+
+# Pages are only read up to </head>; this caps pages that never close it
+MAX_PAGE_BYTES = int(os.environ.get("SCAN_MAX_PAGE_BYTES", str(256 * 1024)))
+HEAD_END_RE = re.compile(rb"</head\s*>", re.IGNORECASE)
+
+# Sentinel telling probe workers / the DB writer that no more items will come
+_DONE = None
+
+def classify_port(port: int, svc_name: str):
+    """Return the scheme to probe for a port, or None if it doesn't look like a web service."""
+    if 'https' in svc_name or 'ssl' in svc_name or port in [443, 8443]:
+        return "https"
+    if 'http' in svc_name or port in [80, 8080, 8000, 3000, 5000, 8081]:
+        return "http"
+    # Heuristic: most unfamiliar high ports on a home server are web UIs,
+    # probe_web_service does a request check anyway.
+    if port > 1000:
+        return "http"
+    return None
+
+async def run_scan_task(target_ip: str, profile_id: int, reporter, mode: str = "ports", resolve_names: bool = False,
+                        use_cache: bool = True):
+    """
+    Scan a target and upsert its web services. `reporter` is a scan_state.ScanReporter.
+    mode: "ports" (nmap sweep), "passive" (mDNS/SSDP only, see discovery.py) or "both".
+    resolve_names: look up host names in the background (see resolver.py) and use them
+    for titles and LAN URLs once probing is done.
+    use_cache: reuse fresh probe results of the same target from another profile's
+    scan (see scan_cache.py). False forces a new scan.
+    """
+    logger.info(f"Starting {mode} scan for {target_ip} on Profile {profile_id}")
     
-    if not NMAP_BIN:
-        add_scan_log("Error: Nmap binary not found.")
+    use_nmap = mode in ("ports", "both")
+    if use_nmap and not get_nmap_bin():
+        reporter.log("Error: Nmap binary not found.")
+        if mode == "ports":
+            return
+        use_nmap = False
+
+    # The scan runs as a producer/consumer pipeline so probing overlaps with discovery:
+    #   nmap stdout / mDNS+SSDP -> probe_queue (bounded) -> probe workers -> result_queue -> batched DB writer
+    # When the probe queue is full the reader stops draining nmap's stdout, so memory
+    # stays flat no matter how many ports are open.
+    probe_queue: asyncio.Queue = asyncio.Queue(maxsize=PROBE_QUEUE_SIZE)
+    result_queue: asyncio.Queue = asyncio.Queue(maxsize=PROBE_QUEUE_SIZE)
+
+    # Per-host timeouts and concurrency, tuned while the scan runs
+    hosts = HostControllers()
+    names = None
+    if resolve_names:
+        names = NameResolver()
+        await names.load_cache()
+
+    key = scan_cache.cache_key(target_ip, NMAP_PORTS if use_nmap else None, mode in ("passive", "both"))
+    cached = await scan_cache.load(key, profile_id) if use_cache else None
+    if cached is not None:
+        results, age = cached
+        reporter.log(f"Reusing the scan of {target_ip} from {age:.0f}s ago ({len(results)} web services).")
+        await _replay_results(results, profile_id, reporter, names)
+    else:
+        # Fingerprints from the last scan, for conditional requests
+        fingerprints = await load_fingerprints(profile_id)
+        # Every probe result, unchanged ones included, for the shared cache
+        collected = []
+        complete = False
+        async with httpx.AsyncClient(verify=False, timeout=INITIAL_TIMEOUT) as client:
+            workers = [
+                asyncio.create_task(_probe_worker(client, probe_queue, result_queue, fingerprints, hosts, reporter.log, names, collected))
+                for _ in range(max(1, PROBE_WORKERS))
+            ]
+            writer = asyncio.create_task(_db_writer(result_queue, profile_id, reporter.log))
+
+            # (host, port) already queued, shared so both producers don't probe the same port twice
+            seen = set()
+            producers = []
+            if use_nmap:
+                producers.append(_read_nmap_ports(target_ip, probe_queue, reporter, seen))
+            if mode in ("passive", "both"):
+                producers.append(_read_discovery(target_ip, probe_queue, reporter, seen))
+
+            try:
+                # Only _read_nmap_ports returns False, when nmap failed
+                complete = False not in await asyncio.gather(*producers)
+                reporter.log(f"Scan finished. Found {len(seen)} open ports.")
+                reporter.progress = max(reporter.progress, 90)
+            finally:
+                for _ in workers:
+                    await probe_queue.put(_DONE)
+                await asyncio.gather(*workers, return_exceptions=True)
+                await result_queue.put(_DONE)
+                await writer
+
+        # Only cache scans that ran to the end, a cut-short or failed scan would hide services
+        if complete:
+            try:
+                await scan_cache.store(key, profile_id, collected)
+            except Exception as e:
+                logger.warning(f"Could not cache scan results: {e}")
+
+    if names:
+        try:
+            await apply_host_names(profile_id, await names.results(), reporter.log)
+        except Exception as e:
+            reporter.log(f"Name resolution failed: {e}")
+
+    for ip, controller in hosts.items():
+        reporter.log(f"{ip}: {controller.summary()}")
+    reporter.progress = 100
+
+async def _replay_results(results: list, profile_id: int, reporter, names: NameResolver = None):
+    """Upsert cached probe results through the normal DB writer."""
+    result_queue: asyncio.Queue = asyncio.Queue(maxsize=PROBE_QUEUE_SIZE)
+    writer = asyncio.create_task(_db_writer(result_queue, profile_id, reporter.log))
+    try:
+        for result in results:
+            if names:
+                names.submit(result["ip"])
+            await result_queue.put(result)
+    finally:
+        await result_queue.put(_DONE)
+        await writer
+    reporter.progress = max(reporter.progress, 90)
+
+# nmap-style ranges: 192.168.1.1-20, 192.168.1.*
+_RANGE_RE = re.compile(r"^[\d.]*[-*][\d.*-]*$")
+
+def _single_host(target: str) -> bool:
+    """Whether a scan target names exactly one host (an ip, /32 or hostname)."""
+    target = target.strip()
+    if " " in target or "," in target or _RANGE_RE.match(target):
+        return False
+    try:
+        return ipaddress.ip_network(target, strict=False).num_addresses == 1
+    except ValueError:
+        return True  # hostname
+
+def _in_target(ip: str, target: str) -> bool:
+    """Whether a passively discovered ip belongs to a multi-host scan target (a CIDR)."""
+    try:
+        return ipaddress.ip_address(ip) in ipaddress.ip_network(target, strict=False)
+    except ValueError:
+        # nmap-style ranges and lists: keep everything we hear about
+        return True
+
+async def _host_addresses(target: str) -> set:
+    """The ips a single-host target (ip or hostname) stands for; empty if it doesn't resolve."""
+    loop = asyncio.get_running_loop()
+    try:
+        infos = await loop.getaddrinfo(target.strip(), None, type=socket.SOCK_STREAM)
+    except (socket.gaierror, OSError):
+        return set()
+    return {info[4][0] for info in infos}
+
+async def _read_discovery(target_ip: str, probe_queue: asyncio.Queue, reporter, seen: set):
+    """Producer: enqueue endpoints advertised over mDNS/SSDP."""
+    # A single host (like nas.local) only takes endpoints of its own addresses, stored
+    # under the target like the nmap producer does, so `seen` dedupes the two
+    single_host = _single_host(target_ip)
+    addresses = await _host_addresses(target_ip) if single_host else None
+    if single_host and not addresses:
+        reporter.log(f"Could not resolve {target_ip}, skipping mDNS/SSDP discovery.")
         return
+    reporter.log("Listening for mDNS/SSDP announcements...")
+    async for endpoint in discover_endpoints():
+        ip, port = endpoint["ip"], endpoint["port"]
+        if single_host:
+            if ip not in addresses:
+                continue
+            host = target_ip
+        elif _in_target(ip, target_ip):
+            host = ip
+        else:
+            continue
+        if (host, port) in seen:
+            continue
+        seen.add((host, port))
+        reporter.log(f"Discovered {endpoint['name'] or 'service'} at {ip}:{port} via {endpoint['source']}")
+        await probe_queue.put((host, port, endpoint["scheme"], endpoint["name"]))
+        if reporter.progress < 90:
+            reporter.progress += 1
 
-    # Construct Command: Scan top 2000 ports + standard service detection
+async def _read_nmap_ports(target_ip: str, probe_queue: asyncio.Queue, reporter, seen: set):
+    """
+    Producer: run nmap and enqueue every open port as soon as it is reported.
+    Returns False if nmap failed, so the (partial) result isn't taken as complete.
+    """
+    # Construct Command: full port range
     # -T4: Aggressive timing
     # --open: Only show open ports
     # -n: No DNS resolution (faster)
-    cmd = [NMAP_BIN, target_ip, "-p", "1-65535", "-T4", "--open", "-n"]
+    # -v: Print "Discovered open port" lines as ports are found instead of only at the end
+    cmd = [get_nmap_bin(), target_ip, "-p", NMAP_PORTS, "-T4", "--open", "-n", "-v"]
     
-    add_scan_log(f"Executing: {' '.join(cmd)}")
+    reporter.log(f"Executing: {' '.join(cmd)}")
     
     process = await asyncio.create_subprocess_exec(
         *cmd,
@@ -95,159 +318,368 @@ async def run_scan_task(target_ip: str, profile_id: int):
         stderr=asyncio.subprocess.PIPE
     )
 
-    # Read output line by line
-    discovered_ports = []
-    
-    # Simple regex to catch "Discovered open port 80/tcp on 192.168.1.1" (nmap output varies)
-    # Standard nmap output for open ports often looks like: "80/tcp open http" in the table
-    # OR if using -v, it says "Discovered open port..."
-    
-    # Let's read line by line
-    while True:
-        line_bytes = await process.stdout.readline()
-        if not line_bytes:
-            break
-        line = line_bytes.decode('utf-8', errors='replace').strip()
-        if not line:
-            continue
-            
-        # Log interesting lines
-        if "Discovered open port" in line:
-            add_scan_log(line)
-        elif "/tcp" in line and "open" in line:
-            add_scan_log(f"Found: {line}")
-            # Parse port: "80/tcp open http"
-            parts = line.split('/')
-            if parts[0].isdigit():
-                port = int(parts[0])
-                service_name = "unknown"
-                if "open" in line:
-                     # try to get service name from the right
-                     remain = line.split("open")[-1].strip()
-                     service_name = remain
-                
-                discovered_ports.append((port, service_name))
-
-        # Update progress just to show activity
-        if scan_status["progress"] < 90:
-             scan_status["progress"] += 1
-
-    await process.wait()
-    
+    # A single-host target (ip or hostname like nas.local) is stored as given; only
+    # ranges/CIDRs use the ip nmap reports, so existing rows and URLs keep their host.
+    single_host = _single_host(target_ip)
+    # Host of the table that follows a "Nmap scan report for" line (targets may be ranges)
+    report_host = target_ip
+    # (host, port) -> scheme it was queued with, None if it wasn't
+    queued = {}
+    services = load_nmap_services()
+    try:
+        while True:
+            line_bytes = await process.stdout.readline()
+            if not line_bytes:
+                break
+            line = line_bytes.decode('utf-8', errors='replace').strip()
+            if not line:
+                continue
+
+            port = None
+            host = report_host
+            svc_name = "unknown"
+            m = DISCOVERED_RE.search(line)
+            if m:
+                reporter.log(line)
+                port = int(m.group(1))
+                host = target_ip if single_host else m.group(2)
+                svc_name = services.get(port, "unknown")
+            elif line.startswith("Nmap scan report for "):
+                if not single_host:
+                    report_host = line.rsplit(" ", 1)[-1].strip("()")
+            else:
+                m = TABLE_RE.match(line)
+                if m:
+                    reporter.log(f"Found: {line}")
+                    port = int(m.group(1))
+                    svc_name = m.group(2).strip() or "unknown"
+
+            # The final table repeats ports already announced by -v, only queue each once...
+            if port is not None:
+                key = (host, port)
+                scheme = classify_port(port, svc_name)
+                if key not in seen:
+                    seen.add(key)
+                    queued[key] = scheme
+                    if scheme:
+                        # Blocks while the probe queue is full (backpressure on nmap)
+                        await probe_queue.put((host, port, scheme, None))
+                elif key in queued and scheme and scheme != queued[key]:
+                    # ...unless the table's service name changes the verdict (no nmap-services file)
+                    queued[key] = scheme
+                    await probe_queue.put((host, port, scheme, None))
+
+            # Update progress just to show activity
+            if reporter.progress < 90:
+                reporter.progress += 1
+
+        await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+
     if process.returncode != 0:
         stderr = await process.stderr.read()
-        add_scan_log(f"Nmap exited with error: {stderr.decode()}")
-    
-    add_scan_log(f"Scan finished. Found {len(discovered_ports)} open ports.")
-    scan_status["progress"] = 90
-    
-    # Process found ports
+        reporter.log(f"Nmap exited with error: {stderr.decode()}")
+        return False
+    return True
+
+async def load_fingerprints(profile_id: int) -> dict:
+    """
+    (ip, port) -> {"etag", "last_modified", "content_hash", "title", "icon_path"} for the
+    profile's services. Title and icon fill in unchanged results, so they are complete
+    enough for the shared scan cache. A locked service's icon may be a custom one, skip it.
+    """
     async with AsyncSessionLocal() as db:
-        for port, svc_name in discovered_ports:
-             # Identify Web Services
-            is_web = False
-            scheme = "http"
-            
-            if 'http' in svc_name or port in [80, 8080, 8000, 3000, 5000, 8081]:
-                is_web = True
-                scheme = "http"
-            elif 'https' in svc_name or 'ssl' in svc_name or port in [443, 8443]:
-                is_web = True
-                scheme = "https"
-            
-            # Heuristic: if unknown, try http check later? For now, be strict or generous.
-            # Let's assume most open ports on home server might be web if not familiar
-            if not is_web and port > 1000:
-                 # Check if it speaks HTTP? 
-                 # We will just try process_web_service which does a request check anyway.
-                 is_web = True 
-            
-            if is_web:
-                base_url = f"{scheme}://{target_ip}:{port}"
-                add_scan_log(f"Probing {base_url}...")
-                await process_web_service(db, target_ip, port, scheme, base_url, profile_id)
+        res = await db.execute(
+            select(Service.ip, Service.port, Service.etag, Service.last_modified, Service.content_hash,
+                   Service.title, Service.icon_url, Service.is_manual_lock)
+            .where(Service.profile_id == profile_id)
+        )
+        return {
+            (ip, port): {"etag": etag, "last_modified": last_modified, "content_hash": content_hash,
+                         "title": title, "icon_path": None if locked else icon_url}
+            for ip, port, etag, last_modified, content_hash, title, icon_url, locked in res.all()
+        }
+
+async def _probe_worker(client: httpx.AsyncClient, probe_queue: asyncio.Queue, result_queue: asyncio.Queue, fingerprints: dict, hosts: HostControllers, log, names: NameResolver = None, collected: list = None):
+    """Consumer: probe queued ports and hand web services to the DB writer (and `collected`, if given)."""
+    while True:
+        item = await probe_queue.get()
+        if item is _DONE:
+            return
+        ip, port, scheme, name = item
+        if names:
+            # Runs in the background, results are applied after the scan
+            names.submit(ip)
+        base_url = f"{scheme}://{ip}:{port}"
+        log(f"Probing {base_url}...")
+        try:
+            result = await probe_web_service(client, ip, port, scheme, base_url, fingerprints.get((ip, port)), hosts[ip])
+        except Exception as e:
+            logger.debug(f"Probe failed for {base_url}: {e}")
+            result = None
+        if result:
+            # Name advertised over mDNS/SSDP, used when the page has no title
+            result["name"] = name
+            if collected is not None:
+                collected.append(result)
+            await result_queue.put(result)
+
+async def _db_writer(result_queue: asyncio.Queue, profile_id: int, log):
+    """Upsert probe results in batches, committing every DB_BATCH_SIZE rows or DB_FLUSH_INTERVAL seconds."""
+    loop = asyncio.get_running_loop()
+    async with AsyncSessionLocal() as db:
+        batch = []  # results upserted since the last commit
+        unchanged = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                result = await asyncio.wait_for(result_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                result = False  # flush tick
+
+            if result and result.get("unchanged"):
+                # Same fingerprint as last scan: nothing to parse, nothing to write
+                unchanged += 1
+            elif result:
+                try:
+                    changed = await upsert_service(db, profile_id, result)
+                    if changed:
+                        log(f"Updated {result['url']}: {', '.join(changed)}")
+                    batch.append(result)
+                except Exception as e:
+                    # Keep draining the queue, otherwise probe workers would block forever
+                    log(f"Failed to save {result['url']}: {e}")
+                    # The failed flush spoiled the transaction: start over without this result
+                    await db.rollback()
+                    batch = await _replay_batch(db, profile_id, batch, log)
+                if deadline is None:
+                    deadline = loop.time() + DB_FLUSH_INTERVAL
+
+            due = deadline is not None and loop.time() >= deadline
+            if batch and (result is _DONE or due or len(batch) >= DB_BATCH_SIZE):
+                try:
+                    await db.commit()
+                except Exception as e:
+                    await db.rollback()
+                    log(f"Failed to save {len(batch)} services: {e}")
+                batch = []
+                deadline = None
+
+            if result is _DONE:
+                if unchanged:
+                    log(f"{unchanged} services unchanged since last scan.")
+                return
 
-    scan_status["progress"] = 100
+async def _replay_batch(db: AsyncSession, profile_id: int, batch: list, log) -> list:
+    """Upsert results again after a rollback, dropping any that fail again. Returns the ones applied."""
+    for i, result in enumerate(batch):
+        try:
+            await upsert_service(db, profile_id, result)
+        except Exception as e:
+            log(f"Failed to save {result['url']}: {e}")
+            await db.rollback()
+            return await _replay_batch(db, profile_id, batch[:i] + batch[i + 1:], log)
+    return batch
 
-async def process_web_service(db: AsyncSession, ip: str, port: int, protocol: str, url: str, profile_id: int):
+async def probe_web_service(client: httpx.AsyncClient, ip: str, port: int, protocol: str, url: str, fingerprint: dict = None, host: HostController = None):
+    """
+    Fetch a page and extract its title and icon. Returns None if it's not a web page.
+    With a fingerprint from the last scan, sends a conditional request and returns
+    {"unchanged": True, ...} without parsing when the page hasn't changed.
+    `host` paces requests and picks timeouts for this ip (see adaptive.py).
+    """
     # 1. Scrape Title and Icon
     title = ""
     icon_path = None
+    fingerprint = fingerprint or {}
+    unchanged = {
+        "ip": ip, "port": port, "protocol": protocol, "url": url, "unchanged": True,
+        # What the last scan stored, so the result stands on its own (scan cache)
+        "title": fingerprint.get("title") or "", "icon_path": fingerprint.get("icon_path"),
+        "etag": fingerprint.get("etag"), "last_modified": fingerprint.get("last_modified"),
+        "content_hash": fingerprint.get("content_hash"),
+    }
     
+    headers = {}
+    if fingerprint.get("etag"):
+        headers["If-None-Match"] = fingerprint["etag"]
+    if fingerprint.get("last_modified"):
+        headers["If-Modified-Since"] = fingerprint["last_modified"]
+    
+    host = host or HostController()
     try:
-        async with httpx.AsyncClient(verify=False, timeout=3.0) as client:
-            resp = await client.get(url)
-            
-            # Stricter validation: Only accept if it's actually HTML content
-            if resp.status_code >= 500:
-                return  # Server error, skip
-            
-            content_type = resp.headers.get('content-type', '').lower()
-            
-            # Must be HTML or text/plain (some servers misconfigure this)
-            if 'html' not in content_type and 'text' not in content_type:
-                return
-            
-            # Parse and validate it's actually HTML
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            
-            # Must have <html> tag or <title> tag to be considered valid web page
-            if not soup.html and not soup.title:
-                return
-            
-            # Extract title
-            if soup.title and soup.title.string:
-                title = soup.title.string.strip()
-            
-            # Try to find favicon
-            icon_url = None
-            icon_link = soup.find("link", rel=lambda x: x and 'icon' in x.lower())
-            if icon_link and icon_link.get('href'):
-                icon_url = urljoin(url, icon_link.get('href'))
-            else:
-                icon_url = urljoin(url, '/favicon.ico')
-            
-            if icon_url:
-                icon_path = await download_icon(client, icon_url, ip, port)
+        fetched = await _fetch_head(client, url, port, headers, host)
+        if fetched is None:
+            return None
+        if fetched == 304:
+            return unchanged
+        content, charset, etag, last_modified = fetched
+        
+        # Title and icon live in <head>, so its hash tells us whether anything we use changed
+        content_hash = hashlib.sha256(content).hexdigest()
+        if fingerprint.get("content_hash") == content_hash:
+            return unchanged
+        
+        # Decoding and parsing are CPU-bound, run them off the event loop
+        page = await run_cpu_bound(parse_page, content, charset, url)
+        if not page:
+            return None
+        
+        title = page["title"]
+        icon_url = page["icon_url"]
+        
+        if icon_url:
+            icon_path = await download_icon(client, icon_url, ip, port, host)
             
     except Exception as e:
         # Not a web service or timeout
-        return
+        return None
+
+    return {
+        "ip": ip,
+        "port": port,
+        "protocol": protocol,
+        "url": url,
+        "title": title,
+        "icon_path": icon_path,
+        "etag": etag,
+        "last_modified": last_modified,
+        "content_hash": content_hash,
+    }
+
+async def _fetch_head(client: httpx.AsyncClient, url: str, port: int, headers: dict, host: HostController):
+    """
+    GET a page through the host's controller, retrying timeouts of a busy host with the backed-off timeout.
+    Returns 304, None (not an HTML page) or (content up to </head>, charset, etag, last_modified).
+    """
+    loop = asyncio.get_running_loop()
+    for attempt in range(PROBE_RETRIES + 1):
+        try:
+            async with host.slot(port) as slot:
+                start = loop.time()
+                async with client.stream("GET", url, headers=headers, timeout=host.timeout(port)) as resp:
+                    slot.rtt = loop.time() - start
+                    if resp.status_code == 304:
+                        return 304
+                    
+                    # Stricter validation: Only accept if it's actually HTML content
+                    if resp.status_code >= 500:
+                        return None  # Server error, skip
+                    
+                    content_type = resp.headers.get('content-type', '').lower()
+                    
+                    # Must be HTML or text/plain (some servers misconfigure this)
+                    if 'html' not in content_type and 'text' not in content_type:
+                        return None
+                    
+                    content = await read_head(resp)
+                    return content, resp.charset_encoding, resp.headers.get('etag'), resp.headers.get('last-modified')
+        except httpx.TimeoutException as e:
+            # Slow host: the controller has already raised its timeout for the retry.
+            # A read timeout on a port that never spoke HTTP is just a non-web service.
+            busy = isinstance(e, (httpx.ConnectTimeout, httpx.PoolTimeout)) or host.answered(port)
+            if attempt == PROBE_RETRIES or not busy:
+                raise
+
+async def read_head(resp: httpx.Response) -> bytes:
+    """Read the body up to the end of <head> (or MAX_PAGE_BYTES), the rest is never used."""
+    buf = b""
+    async for chunk in resp.aiter_bytes():
+        buf += chunk
+        m = HEAD_END_RE.search(buf)
+        if m:
+            return buf[:m.end()]
+        if len(buf) >= MAX_PAGE_BYTES:
+            return buf[:MAX_PAGE_BYTES]
+    return buf
+
+async def upsert_service(db: AsyncSession, profile_id: int, result: dict) -> list:
+    """
+    Insert or update a probed service - SCOPED BY PROFILE. The caller commits.
+    Returns the names of the fields that changed on an existing service.
+    """
+    ip, port, url = result["ip"], result["port"], result["url"]
+    title, icon_path = result["title"], result["icon_path"]
+    changed = []
 
-    # 2. Database Upsert - SCOPED BY PROFILE
-    result = await db.execute(select(Service).where(Service.ip == ip, Service.port == port, Service.profile_id == profile_id))
-    existing_service = result.scalars().first()
+    res = await db.execute(select(Service).where(Service.ip == ip, Service.port == port, Service.profile_id == profile_id))
+    existing_service = res.scalars().first()
 
     if existing_service:
         if not existing_service.is_manual_lock:
-            existing_service.title = title or existing_service.title
-            existing_service.protocol = protocol
-            existing_service.url = url
-            if icon_path:
-                existing_service.icon_url = icon_path
-            existing_service.last_scanned = datetime.utcnow()
+            updates = {
+                "title": title or result.get("name") or existing_service.title,
+                "protocol": result["protocol"],
+                "url": url,
+                "icon_url": icon_path or existing_service.icon_url,
+            }
+            for field, value in updates.items():
+                if getattr(existing_service, field) != value:
+                    setattr(existing_service, field, value)
+                    changed.append(field)
+            existing_service.changed_fields = ",".join(changed) or None
+        existing_service.etag = result.get("etag")
+        existing_service.last_modified = result.get("last_modified")
+        existing_service.content_hash = result.get("content_hash")
+        existing_service.last_scanned = datetime.utcnow()
     else:
         new_service = Service(
             profile_id=profile_id,
             ip=ip,
             port=port,
-            protocol=protocol,
+            protocol=result["protocol"],
             url=url,
             lan_url=url, # Default LAN is detected IP
             wan_url=None,
-            title=title or f"Port {port}",
+            title=title or result.get("name") or f"Port {port}",
             custom_name=None,
             icon_url=icon_path,
             is_visible=True,
-            is_manual_lock=False
+            is_manual_lock=False,
+            etag=result.get("etag"),
+            last_modified=result.get("last_modified"),
+            content_hash=result.get("content_hash"),
         )
         db.add(new_service)
-    
-    await db.commit()
+        # Flush so a later result for the same ip/port in this batch finds this row
+        await db.flush()
+
+    return changed
+
+async def apply_host_names(profile_id: int, names: dict, log):
+    """
+    Store resolved names on the profile's services in one transaction.
+    Unlocked services still titled "Port N" become "name:port", and a LAN URL that is
+    still the detected IP URL switches to the name. NetBIOS names are left out of
+    LAN URLs, most non-Windows clients can't resolve them.
+    """
+    if not names:
+        return
+    updated = 0
+    async with AsyncSessionLocal() as db:
+        res = await db.execute(select(Service).where(Service.profile_id == profile_id, Service.ip.in_(list(names))))
+        for service in res.scalars():
+            name, source = names[service.ip]
+            if service.hostname != name:
+                service.hostname = name
+                updated += 1
+            if service.is_manual_lock:
+                continue
+            if not service.title or service.title == f"Port {service.port}":
+                service.title = f"{name}:{service.port}"
+            if source in ("dns", "mdns") and (not service.lan_url or service.lan_url == service.url):
+                service.lan_url = f"{service.protocol}://{name}:{service.port}"
+        await db.commit()
+    log(f"Resolved {len(names)} host names, {updated} services updated.")
 
-async def download_icon(client: httpx.AsyncClient, url: str, ip: str, port: int) -> str:
+async def download_icon(client: httpx.AsyncClient, url: str, ip: str, port: int, host: HostController = None) -> str:
+    host = host or HostController()
     try:
-        resp = await client.get(url)
+        async with host.slot(port):
+            resp = await client.get(url, timeout=host.timeout(port))
         if resp.status_code == 200:
             filename = f"{ip}_{port}_{os.path.basename(urlparse(url).path) or 'favicon.ico'}"
             # Sanitize filename
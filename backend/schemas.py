@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 
@@ -53,6 +53,8 @@ class ServiceResponse(ServiceBase):
     url: str # Original Detected URL
     title: str
     last_scanned: datetime
+    changed_fields: Optional[str] = None # Fields changed by the last scan, comma separated
+    hostname: Optional[str] = None # Resolved host name, if the scan resolved names
     
     class Config:
         from_attributes = True
@@ -60,6 +62,9 @@ class ServiceResponse(ServiceBase):
 class ScanRequest(BaseModel):
     target_ip: str
     profile_id: int
+    mode: str = "ports" # "ports" (nmap), "passive" (mDNS/SSDP) or "both"
+    resolve_names: bool = False # Look up host names (DNS/mDNS/NetBIOS) for titles and LAN URLs
+    use_cache: bool = True # Reuse a recent scan of the same target by another profile
 
 # --- Reorder ---
 class ReorderRequest(BaseModel):
@@ -92,3 +97,24 @@ class AppSettingsUpdate(BaseModel):
     theme_mode: Optional[str] = None
     accent_color: Optional[str] = None
     default_sort_by: Optional[str] = None
+
+# --- Import (see transfer.py) ---
+class ServiceImport(BaseModel):
+    """A service record of an import. Every field is optional, other keys are ignored."""
+    ip: Optional[str] = None
+    port: Optional[int] = Field(None, ge=0, le=65535)
+    protocol: Optional[str] = None
+    url: Optional[str] = None
+    lan_url: Optional[str] = None
+    wan_url: Optional[str] = None
+    title: Optional[str] = None
+    custom_name: Optional[str] = None
+    icon_url: Optional[str] = None
+    is_visible: Optional[bool] = None
+    is_manual_lock: Optional[bool] = None
+    sort_order: Optional[int] = None
+    last_scanned: Optional[datetime] = None
+
+class IconImport(BaseModel):
+    path: str
+    data: str  # base64
@@ -0,0 +1,304 @@
+"""
+Bulk export / import of a profile's services, app settings and icons.
+
+Both directions stream: export is an async generator over the DB cursor, import
+reads the request body line by line and writes in chunked transactions, so
+memory stays flat for profiles of any size.
+
+Format: one JSON record per line, each with a "type":
+    {"type": "meta", "version": 1, ...}
+    {"type": "settings", "site_title": ..., ...}
+    {"type": "profile", "name": ..., "scan_target": ...}
+    {"type": "service", "ip": ..., "port": ..., ...}
+    {"type": "icon", "path": "/static/icons/x.png", "data": "<base64>"}
+
+The "json" variant wraps the same lines in [ ... ] with leading commas, so
+import can still read it line by line. Records without "type" are treated as
+services, which makes it easy to import lists from other dashboards.
+
+Records are validated with the pydantic models in schemas.py. spool_records
+checks the whole upload (kept in a temp file that spills to disk) before
+import_records writes anything, so a bad record can't leave half an import.
+"""
+import base64
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from pydantic import ValidationError
+
+from sqlalchemy import insert, update, or_
+from sqlalchemy.future import select
+
+import database
+from database import Service, Profile, AppSettings
+from icon_bundle import _icon_path
+from schemas import ServiceImport, IconImport, AppSettingsUpdate
+
+FORMAT_VERSION = 1
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "500"))
+# Uploads bigger than this are spooled to disk while they are validated
+IMPORT_SPOOL_MEMORY = 8 * 1024 * 1024
+# What /api/services/manual stores for services without an address
+PLACEHOLDER_IP = "0.0.0.0"
+
+SERVICE_FIELDS = [
+    "ip", "port", "protocol", "url", "lan_url", "wan_url", "title", "custom_name",
+    "icon_url", "is_visible", "is_manual_lock", "sort_order", "last_scanned",
+]
+SETTINGS_FIELDS = [
+    "site_title", "site_icon_url", "view_mode", "grid_size", "theme_mode", "accent_color", "default_sort_by",
+]
+
+def _service_record(service: Service) -> dict:
+    record = {"type": "service"}
+    for field in SERVICE_FIELDS:
+        value = getattr(service, field)
+        record[field] = value.isoformat() if isinstance(value, datetime) else value
+    return record
+
+async def export_records(profile_id: int, include_icons: bool = True):
+    """Yield export records one at a time."""
+    async with database.AsyncSessionLocal() as db:
+        yield {"type": "meta", "version": FORMAT_VERSION, "exported_at": datetime.utcnow().isoformat()}
+
+        settings = (await db.execute(select(AppSettings))).scalars().first()
+        if settings:
+            yield {"type": "settings", **{f: getattr(settings, f) for f in SETTINGS_FIELDS}}
+
+        profile = (await db.execute(select(Profile).where(Profile.id == profile_id))).scalars().first()
+        if profile:
+            yield {"type": "profile", "name": profile.name, "scan_target": profile.scan_target,
+                   "is_guest_default": profile.is_guest_default}
+
+        icons = set()
+        if settings and settings.site_icon_url:
+            icons.add(settings.site_icon_url)
+
+        stream = await db.stream_scalars(
+            select(Service)
+            .where(Service.profile_id == profile_id)
+            .order_by(Service.id)
+            .execution_options(yield_per=IMPORT_BATCH_SIZE)
+        )
+        async for service in stream:
+            if service.icon_url:
+                icons.add(service.icon_url)
+            yield _service_record(service)
+
+    if include_icons:
+        for icon_url in sorted(icons):
+            path = _icon_path(icon_url)
+            if path and os.path.isfile(path):
+                with open(path, "rb") as f:
+                    data = base64.b64encode(f.read()).decode("ascii")
+                yield {"type": "icon", "path": icon_url, "data": data}
+
+async def export_stream(profile_id: int, fmt: str = "ndjson", include_icons: bool = True):
+    """Serialize export_records as NDJSON or as a JSON array (one record per line)."""
+    first = True
+    if fmt == "json":
+        yield "[\n"
+    async for record in export_records(profile_id, include_icons):
+        line = json.dumps(record, ensure_ascii=False)
+        if fmt == "json":
+            line = line if first else "," + line
+        first = False
+        yield line + "\n"
+    if fmt == "json":
+        yield "]\n"
+
+async def iter_records(chunks):
+    """Parse records from a stream of byte chunks (NDJSON or our line-based JSON array)."""
+    buf = b""
+    async for chunk in chunks:
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            record = _parse_line(line)
+            if record is not None:
+                yield record
+    record = _parse_line(buf)
+    if record is not None:
+        yield record
+
+def _parse_line(line: bytes):
+    line = line.strip()
+    if line.startswith(b"["):
+        line = line[1:].strip()
+    if line.endswith(b"]"):
+        line = line[:-1].strip()
+    if line.startswith(b","):
+        line = line[1:].strip()
+    if line.endswith(b","):
+        line = line[:-1].strip()
+    if not line:
+        return None
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("Every record must be a JSON object")
+    return record
+
+RECORD_MODELS = {"service": ServiceImport, "icon": IconImport, "settings": AppSettingsUpdate}
+
+def check_record(record: dict, number: int) -> dict:
+    """The validated fields of a record (those it actually has), or ValueError naming the record."""
+    model = RECORD_MODELS.get(record.get("type", "service"))
+    if model is None:
+        return {}  # "meta", "profile": informational
+    try:
+        return model.model_validate(record).model_dump(exclude_unset=True)
+    except ValidationError as e:
+        problems = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+        raise ValueError(f"record {number}: {problems}")
+
+async def spool_records(records):
+    """
+    Validate every record before anything is written. Returns a temp file with the
+    records, for import_records(iter_spooled(spool)); the caller closes it.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_MEMORY)
+    try:
+        number = 0
+        async for record in records:
+            number += 1
+            check_record(record, number)
+            spool.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+async def iter_spooled(spool, chunk_size: int = 64 * 1024):
+    """Records of a spool_records file."""
+    async def chunks():
+        while True:
+            chunk = spool.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    async for record in iter_records(chunks()):
+        yield record
+
+def _service_values(fields: dict, profile_id: int) -> dict:
+    """Row values of a service record validated by check_record."""
+    values = {f: fields[f] for f in SERVICE_FIELDS if f in fields}
+    values["profile_id"] = profile_id
+    values["ip"] = str(values.get("ip") or PLACEHOLDER_IP)
+    values["port"] = int(values.get("port") or 80)
+    return values
+
+def _match_key(record: dict, values: dict):
+    """
+    What an imported service is matched on: its address when the record really has
+    one, else its (url, title). Manual services all share the 0.0.0.0:80 placeholder,
+    so that never counts as an address. None means "always insert".
+    """
+    if record.get("ip") and record.get("port") and values["ip"] != PLACEHOLDER_IP:
+        return ("addr", values["ip"], values["port"])
+    if values.get("url") or values.get("title"):
+        return ("entry", values.get("url") or "", values.get("title") or "")
+    return None
+
+async def _existing_ids(db, profile_id: int, keys) -> dict:
+    """match key -> id of the profile's services that match a key of the batch."""
+    existing = {}
+    ips = {k[1] for k in keys if k[0] == "addr"}
+    if ips:
+        res = await db.execute(
+            select(Service.id, Service.ip, Service.port)
+            .where(Service.profile_id == profile_id)
+            .where(Service.ip.in_(ips))
+        )
+        existing.update({("addr", ip, port): sid for sid, ip, port in res.all()})
+    urls = {k[1] for k in keys if k[0] == "entry"}
+    if urls:
+        res = await db.execute(
+            select(Service.id, Service.url, Service.title)
+            .where(Service.profile_id == profile_id)
+            .where(or_(Service.url.in_(urls), Service.url.is_(None)))
+        )
+        existing.update({("entry", url or "", title or ""): sid for sid, url, title in res.all()})
+    return {key: existing[key] for key in keys if key in existing}
+
+async def _write_batch(profile_id: int, batch: dict, unkeyed: list, on_conflict: str, stats: dict):
+    """Upsert one batch (match key -> values, see _match_key) plus unmatched new services in a single transaction."""
+    async with database.AsyncSessionLocal() as db:
+        existing = await _existing_ids(db, profile_id, batch.keys())
+
+        new_rows = []
+        updates = []
+        for key, values in [*batch.items(), *((None, v) for v in unkeyed)]:
+            if key not in existing:
+                new_rows.append({
+                    "protocol": "http", "url": "", "title": "", "is_visible": True,
+                    "is_manual_lock": True, "sort_order": 0, "last_scanned": datetime.utcnow(),
+                    **values,
+                })
+            elif on_conflict == "skip":
+                stats["skipped"] += 1
+            else:
+                updates.append({"id": existing[key], **values})
+
+        if new_rows:
+            await db.execute(insert(Service), new_rows)
+        if updates:
+            # Bulk UPDATE by primary key
+            await db.execute(update(Service), updates)
+        await db.commit()
+
+    stats["inserted"] += len(new_rows)
+    stats["updated"] += len(updates)
+
+async def import_records(profile_id: int, records, on_conflict: str = "update", import_settings: bool = False) -> dict:
+    """
+    Consume an async iterator of records into a profile. on_conflict: 'update' or 'skip'.
+    Records are checked one by one as they come; run them through spool_records first
+    to reject a bad upload before anything is written.
+    """
+    stats = {"inserted": 0, "updated": 0, "skipped": 0, "duplicates": 0, "icons": 0, "settings": False}
+    batch = {}
+    unkeyed = []
+
+    number = 0
+    async for record in records:
+        number += 1
+        kind = record.get("type", "service")
+        fields = check_record(record, number)
+        if kind == "service":
+            values = _service_values(fields, profile_id)
+            key = _match_key(fields, values)
+            if key is None:
+                # Nothing to match on: always a new service
+                unkeyed.append(values)
+            else:
+                if key in batch:
+                    stats["duplicates"] += 1  # later duplicates in the same file win
+                batch[key] = values
+            if len(batch) + len(unkeyed) >= IMPORT_BATCH_SIZE:
+                await _write_batch(profile_id, batch, unkeyed, on_conflict, stats)
+                batch, unkeyed = {}, []
+        elif kind == "icon":
+            path = _icon_path(fields["path"])
+            if path and fields["data"]:
+                with open(path, "wb") as f:
+                    f.write(base64.b64decode(fields["data"]))
+                stats["icons"] += 1
+        elif kind == "settings" and import_settings:
+            async with database.AsyncSessionLocal() as db:
+                settings = (await db.execute(select(AppSettings))).scalars().first()
+                if not settings:
+                    settings = AppSettings()
+                    db.add(settings)
+                for field in SETTINGS_FIELDS:
+                    if field in fields:
+                        setattr(settings, field, fields[field])
+                await db.commit()
+            stats["settings"] = True
+        # "meta" and "profile" records are informational
+
+    if batch or unkeyed:
+        await _write_batch(profile_id, batch, unkeyed, on_conflict, stats)
+    return stats
@@ -105,6 +105,42 @@ export const getServices = async (profileId: number = 1): Promise<Service[]> =>
     return data;
 };
 
+export interface IconBundle {
+    version: string;
+    icons: Record<string, string>; // icon_url -> data URI
+}
+
+// All local icons of a profile in one request (ETag-cached by the browser)
+export const getIconBundle = async (profileId: number): Promise<IconBundle> => {
+    const { data } = await api.get(`/profiles/${profileId}/icons`);
+    return data;
+};
+
+// --- Live changes (server-sent events, see backend/change_feed.py) ---
+export interface ChangeEvent {
+    seq: number;
+    entity: 'service' | 'profile' | 'settings';
+    op: 'upsert' | 'delete' | 'resync';
+    id?: number;
+    profile_id?: number;
+    data?: Record<string, any>; // Full row for upserts
+}
+
+// Events: "hello" (current seq), "change" (ChangeEvent) and "resync" (re-fetch everything).
+// The browser reconnects on its own and resumes from the last event id.
+// EventSource can't send the Authorization header, so logged-in clients connect with a
+// short-lived ticket instead of their token. Without one the server only sends what a
+// guest may see; a stale ticket gets an "unauthorized" event (fetch a new one).
+export const getChangeFeedTicket = async (): Promise<string> => {
+    const { data } = await api.post('/changes/ticket');
+    return data.ticket;
+};
+
+export const openChangeFeed = (profileId: number, ticket?: string): EventSource => {
+    const auth = ticket ? `&ticket=${encodeURIComponent(ticket)}` : '';
+    return new EventSource(`${API_BASE}/changes/stream?profile_id=${profileId}${auth}`);
+};
+
 export const updateService = async (id: number, updates: Partial<Service>) => {
     const { data } = await api.post(`/services/${id}`, updates);
     return data;
@@ -119,8 +155,9 @@ export const reorderServices = async (orderedIds: number[]): Promise<void> => {
     await api.post('/reorder-services', { ordered_ids: orderedIds });
 };
 
-export const triggerScan = async (targetIP: string, profileId: number): Promise<void> => {
-    await api.post('/scan', { target_ip: targetIP, profile_id: profileId });
+// useCache=false scans again even if another profile scanned the same target moments ago
+export const triggerScan = async (targetIP: string, profileId: number, useCache: boolean = true): Promise<void> => {
+    await api.post('/scan', { target_ip: targetIP, profile_id: profileId, use_cache: useCache });
 };
 
 // --- Upload ---